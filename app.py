@@ -1,6 +1,7 @@
 import streamlit as st
 import sys
 import os
+from itertools import islice
 from pathlib import Path
 
 # Add src directory to path
@@ -67,7 +68,8 @@ def home_page():
     # Show recent activities if available
     if st.session_state.get('processed_videos'):
         st.subheader("📋 Recent Videos")
-        for video in st.session_state.processed_videos[-5:]:
+        recent_videos = list(islice(reversed(st.session_state.processed_videos), 5))
+        for video in reversed(recent_videos):
             st.write(f"• {video.get('title', 'Unknown Title')}")
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@
 Video Content Analyzer - Run Script
 """
 
+import importlib.util
 import os
 import sys
 import subprocess
@@ -10,30 +11,27 @@ from pathlib import Path
 
 def check_dependencies():
     """Check if required dependencies are installed"""
-    try:
-        import streamlit
-        import openai
-        import chromadb
-        print("✓ Dependencies check passed")
-        return True
-    except ImportError as e:
-        print(f"✗ Missing dependency: {e}")
-        print("Please install dependencies with: uv sync")
-        return False
+    # Resolve module specs only; importing these packages is slow
+    for name in ("streamlit", "openai", "chromadb"):
+        if importlib.util.find_spec(name) is None:
+            print(f"✗ Missing dependency: {name}")
+            print("Please install dependencies with: uv sync")
+            return False
+    
+    print("✓ Dependencies check passed")
+    return True
 
 def setup_environment():
     """Setup environment and data directories"""
-    # Create data directories
-    data_dirs = [
-        'data',
-        'data/transcripts',
-        'data/notes', 
-        'data/embeddings',
-        'data/cache'
-    ]
+    # Create data directories (skipped once the marker file exists)
+    data_dir = Path('data')
+    marker = data_dir / '.initialized'
     
-    for dir_path in data_dirs:
-        os.makedirs(dir_path, exist_ok=True)
+    if not marker.is_file():
+        data_dir.mkdir(exist_ok=True)
+        for sub_dir in ('transcripts', 'notes', 'embeddings', 'cache'):
+            (data_dir / sub_dir).mkdir(exist_ok=True)
+        marker.touch()
     
     # Check for .env file
     if not os.path.exists('.env'):
@@ -1,7 +1,16 @@
 import streamlit as st
 
+def go_to_page(page):
+    """Button callback that switches to another page on the next run"""
+    st.session_state.pending_page = page
+
 def setup_navigation():
     """Setup sidebar navigation and return selected page"""
+    # Apply a page switch requested by a button before the menu is drawn
+    pending_page = st.session_state.pop('pending_page', None)
+    if pending_page:
+        st.session_state.nav_page = pending_page
+    
     with st.sidebar:
         st.title("📚 Navigation")
         
@@ -9,7 +18,8 @@ def setup_navigation():
         page = st.selectbox(
             "Choose a page:",
             ["Home", "Upload Video", "View Notes", "Q&A"],
-            index=0
+            index=0,
+            key="nav_page"
         )
         
         # Show processing status if available
@@ -60,7 +70,8 @@ def setup_navigation():
         if st.button("🗑️ Clear All Data", type="secondary"):
             keys_to_clear = [
                 'processed_videos', 'current_video', 'current_transcript',
-                'current_notes', 'vector_store', 'processing_status'
+                'current_notes', 'vector_store', 'processing_status',
+                'concept_index'
             ]
             for key in keys_to_clear:
                 if key in st.session_state:
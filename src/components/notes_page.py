@@ -1,6 +1,9 @@
 import streamlit as st
+import io
 import json
 from datetime import datetime
+from components.navigation import go_to_page
+from utils.config import format_timestamp
 
 def notes_page():
     st.title("📄 Video Notes")
@@ -8,13 +11,15 @@ def notes_page():
     # Check if notes are available
     if not st.session_state.get('current_notes'):
         st.warning("No notes available. Please process a video first.")
-        if st.button("🔄 Go to Upload"):
-            st.switch_page("upload_page")
+        st.button("🔄 Go to Upload", on_click=go_to_page, args=("Upload Video",))
         return
     
     notes = st.session_state.current_notes
     video_info = st.session_state.get('current_video', {})
     
+    # Build derived lookup structures once per notes document
+    prepare_notes_index(notes)
+    
     # Video information header
     display_video_header(video_info)
     
@@ -27,6 +32,44 @@ def notes_page():
     # Export options
     display_export_options(notes, video_info)
 
+def prepare_notes_index(notes):
+    """Build per-section lookup structures when a new notes document is loaded"""
+    if st.session_state.get('_notes_index_source') is notes:
+        return
+    
+    sections = notes.get('sections', [])
+    st.session_state['_notes_search_index'] = _build_search_index(notes)
+    st.session_state['_notes_timeline_order'] = sorted(
+        range(len(sections)),
+        key=lambda i: _timestamp_seconds(sections[i].get('timestamp', '00:00'))
+    )
+    st.session_state['_notes_index_source'] = notes
+
+def _build_search_index(notes):
+    """Build a lowercase searchable blob for each section"""
+    index = []
+    
+    for section in notes.get('sections', []):
+        fields = [
+            section.get('title', ''),
+            section.get('content', ''),
+            *section.get('key_points', []),
+            *section.get('quotes', [])
+        ]
+        index.append(" ".join(str(field) for field in fields).lower())
+    
+    return index
+
+def _timestamp_seconds(timestamp):
+    """Convert an MM:SS or HH:MM:SS timestamp to seconds for numeric ordering"""
+    seconds = 0
+    try:
+        for part in str(timestamp).split(':'):
+            seconds = seconds * 60 + int(part)
+    except ValueError:
+        return 0
+    return seconds
+
 def display_video_header(video_info):
     """Display video information header"""
     st.markdown("---")
@@ -40,7 +83,7 @@ def display_video_header(video_info):
         st.metric("Duration", video_info.get('duration', 'Unknown'))
     
     with col3:
-        st.metric("Processed", video_info.get('processed_at', 'Recently'))
+        st.metric("Processed", format_timestamp(video_info.get('processed_at')))
     
     if video_info.get('description'):
         with st.expander("📝 Video Description"):
@@ -48,22 +91,26 @@ def display_video_header(video_info):
 
 def display_notes_controls(notes):
     """Display notes navigation and search controls"""
-    col1, col2, col3 = st.columns([2, 1, 1])
-    
-    with col1:
-        search_query = st.text_input(
-            "🔍 Search in notes",
-            placeholder="Search for topics, keywords, or phrases..."
-        )
-    
-    with col2:
-        view_mode = st.selectbox(
-            "View Mode",
-            ["Structured", "Timeline", "Summary"]
-        )
-    
-    with col3:
-        show_timestamps = st.checkbox("Show Timestamps", value=True)
+    # Batch control changes so the notes only re-render on submit
+    with st.form("notes_controls", clear_on_submit=False):
+        col1, col2, col3 = st.columns([2, 1, 1])
+        
+        with col1:
+            search_query = st.text_input(
+                "🔍 Search in notes",
+                placeholder="Search for topics, keywords, or phrases..."
+            )
+        
+        with col2:
+            view_mode = st.selectbox(
+                "View Mode",
+                ["Structured", "Timeline", "Summary"]
+            )
+        
+        with col3:
+            show_timestamps = st.checkbox("Show Timestamps", value=True)
+        
+        st.form_submit_button("Apply")
     
     # Apply search filter
     if search_query:
@@ -89,17 +136,27 @@ def display_structured_notes(notes):
     """Display notes in structured format"""
     st.markdown("---")
     
+    sections = notes.get('sections', [])
+    
+    # Filter once so the table of contents matches the rendered sections
+    search_query = st.session_state.get('search_query')
+    visible_idx = [
+        i for i, blob in enumerate(st.session_state['_notes_search_index'])
+        if not search_query or search_query in blob
+    ]
+    
     # Table of contents
-    if notes.get('sections'):
+    if visible_idx:
         with st.expander("📚 Table of Contents"):
-            for i, section in enumerate(notes['sections']):
+            for i in visible_idx:
+                section = sections[i]
                 title = section.get('title', f'Section {i+1}')
                 timestamp = section.get('timestamp', '')
                 st.write(f"**{i+1}.** {title} {timestamp}")
     
     # Main content sections
-    for i, section in enumerate(notes.get('sections', [])):
-        display_section(section, i+1)
+    for i in visible_idx:
+        display_section(sections[i], i+1)
 
 def display_section(section, section_num):
     """Display individual section"""
@@ -109,12 +166,6 @@ def display_section(section, section_num):
     key_points = section.get('key_points', [])
     quotes = section.get('quotes', [])
     
-    # Check search filter
-    if st.session_state.get('search_query'):
-        search_query = st.session_state.search_query
-        if not any(search_query in str(item).lower() for item in [title, content, key_points, quotes]):
-            return
-    
     # Section header
     header = f"## {section_num}. {title}"
     if st.session_state.get('show_timestamps') and timestamp:
@@ -145,20 +196,20 @@ def display_timeline_notes(notes):
     st.markdown("---")
     st.subheader("⏰ Timeline View")
     
-    # Sort sections by timestamp if available
+    # Sections in timestamp order, precomputed when the notes were loaded
     sections = notes.get('sections', [])
-    sorted_sections = sorted(sections, key=lambda x: x.get('timestamp', '00:00'))
+    search_index = st.session_state['_notes_search_index']
+    search_query = st.session_state.get('search_query')
     
-    for i, section in enumerate(sorted_sections):
+    for i, section_idx in enumerate(st.session_state['_notes_timeline_order']):
+        section = sections[section_idx]
         timestamp = section.get('timestamp', '00:00')
         title = section.get('title', f'Section {i+1}')
         content = section.get('content', '')
         
         # Check search filter
-        if st.session_state.get('search_query'):
-            search_query = st.session_state.search_query
-            if not any(search_query in str(item).lower() for item in [title, content]):
-                continue
+        if search_query and search_query not in search_index[section_idx]:
+            continue
         
         # Timeline entry
         col1, col2 = st.columns([1, 4])
@@ -216,126 +267,144 @@ def display_export_options(notes, video_info):
     st.markdown("---")
     st.subheader("📤 Export Options")
     
+    file_stem = f"notes_{video_info.get('title', 'video')}"
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        if st.button("📄 Export as Markdown"):
-            markdown_content = generate_markdown_export(notes, video_info)
-            st.download_button(
-                label="Download Markdown",
-                data=markdown_content,
-                file_name=f"notes_{video_info.get('title', 'video')}.md",
-                mime="text/markdown"
-            )
+        st.download_button(
+            label="📄 Export as Markdown",
+            data=get_export_payload('markdown', notes, video_info),
+            file_name=f"{file_stem}.md",
+            mime="text/markdown"
+        )
     
     with col2:
-        if st.button("📋 Export as JSON"):
-            json_content = json.dumps(notes, indent=2)
-            st.download_button(
-                label="Download JSON",
-                data=json_content,
-                file_name=f"notes_{video_info.get('title', 'video')}.json",
-                mime="application/json"
-            )
+        st.download_button(
+            label="📋 Export as JSON",
+            data=get_export_payload('json', notes, video_info),
+            file_name=f"{file_stem}.json",
+            mime="application/json"
+        )
     
     with col3:
-        if st.button("📝 Export as Text"):
-            text_content = generate_text_export(notes, video_info)
-            st.download_button(
-                label="Download Text",
-                data=text_content,
-                file_name=f"notes_{video_info.get('title', 'video')}.txt",
-                mime="text/plain"
-            )
+        st.download_button(
+            label="📝 Export as Text",
+            data=get_export_payload('text', notes, video_info),
+            file_name=f"{file_stem}.txt",
+            mime="text/plain"
+        )
+
+def get_export_payload(export_format, notes, video_info):
+    """Build an export payload once per notes document and reuse it across reruns"""
+    exports = st.session_state.get('_notes_exports')
+    if not exports or exports['source'] is not notes:
+        exports = {'source': notes, 'payloads': {}}
+        st.session_state['_notes_exports'] = exports
+    
+    payloads = exports['payloads']
+    if export_format not in payloads:
+        if export_format == 'markdown':
+            payloads[export_format] = generate_markdown_export(notes, video_info)
+        elif export_format == 'json':
+            payloads[export_format] = json.dumps(notes, indent=2)
+        else:
+            payloads[export_format] = generate_text_export(notes, video_info)
+    
+    return payloads[export_format]
 
 def generate_markdown_export(notes, video_info):
     """Generate markdown export content"""
-    content = []
+    title = video_info.get('title', 'Video Notes')
+    duration = video_info.get('duration', 'Unknown')
+    processed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    summary = notes.get('summary')
+    
+    buf = io.StringIO()
+    w = buf.write
     
     # Header
-    content.append(f"# {video_info.get('title', 'Video Notes')}")
-    content.append(f"**Duration**: {video_info.get('duration', 'Unknown')}")
-    content.append(f"**Processed**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    content.append("")
+    w(f"# {title}\n**Duration**: {duration}\n**Processed**: {processed}\n\n")
     
     # Summary
-    if notes.get('summary'):
-        content.append("## Summary")
-        content.append(notes['summary'])
-        content.append("")
+    if summary:
+        w(f"## Summary\n{summary}\n\n")
     
     # Sections
-    for i, section in enumerate(notes.get('sections', [])):
-        title = section.get('title', f'Section {i+1}')
-        timestamp = section.get('timestamp', '')
+    for i, section in enumerate(notes.get('sections', []), 1):
+        get = section.get
+        section_title = get('title', f'Section {i}')
+        timestamp = get('timestamp', '')
+        content = get('content')
+        key_points = get('key_points')
+        quotes = get('quotes')
         
-        content.append(f"## {i+1}. {title}")
+        w(f"## {i}. {section_title}\n")
         if timestamp:
-            content.append(f"**Timestamp**: {timestamp}")
-        content.append("")
+            w(f"**Timestamp**: {timestamp}\n")
+        w("\n")
         
-        if section.get('content'):
-            content.append(section['content'])
-            content.append("")
+        if content:
+            w(f"{content}\n\n")
         
-        if section.get('key_points'):
-            content.append("### Key Points")
-            for point in section['key_points']:
-                content.append(f"- {point}")
-            content.append("")
+        if key_points:
+            w("### Key Points\n")
+            w("\n".join(f"- {point}" for point in key_points))
+            w("\n\n")
         
-        if section.get('quotes'):
-            content.append("### Important Quotes")
-            for quote in section['quotes']:
-                content.append(f"> {quote}")
-            content.append("")
+        if quotes:
+            w("### Important Quotes\n")
+            w("\n".join(f"> {quote}" for quote in quotes))
+            w("\n\n")
     
-    return "\n".join(content)
+    # Drop the line break after the last line
+    return buf.getvalue()[:-1]
 
 def generate_text_export(notes, video_info):
     """Generate plain text export content"""
-    content = []
+    title = video_info.get('title', 'Unknown Title')
+    duration = video_info.get('duration', 'Unknown')
+    processed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    summary = notes.get('summary')
+    
+    buf = io.StringIO()
+    w = buf.write
     
     # Header
-    content.append(f"VIDEO NOTES: {video_info.get('title', 'Unknown Title')}")
-    content.append("=" * 50)
-    content.append(f"Duration: {video_info.get('duration', 'Unknown')}")
-    content.append(f"Processed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    content.append("")
+    w(f"VIDEO NOTES: {title}\n{'=' * 50}\nDuration: {duration}\nProcessed: {processed}\n\n")
     
     # Summary
-    if notes.get('summary'):
-        content.append("SUMMARY")
-        content.append("-" * 20)
-        content.append(notes['summary'])
-        content.append("")
+    if summary:
+        w(f"SUMMARY\n{'-' * 20}\n{summary}\n\n")
     
     # Sections
-    for i, section in enumerate(notes.get('sections', [])):
-        title = section.get('title', f'Section {i+1}')
-        timestamp = section.get('timestamp', '')
+    divider = "-" * 40 + "\n"
+    for i, section in enumerate(notes.get('sections', []), 1):
+        get = section.get
+        section_title = get('title', f'Section {i}')
+        timestamp = get('timestamp', '')
+        content = get('content')
+        key_points = get('key_points')
+        quotes = get('quotes')
         
-        content.append(f"{i+1}. {title}")
+        w(f"{i}. {section_title}\n")
         if timestamp:
-            content.append(f"   Timestamp: {timestamp}")
-        content.append("")
+            w(f"   Timestamp: {timestamp}\n")
+        w("\n")
         
-        if section.get('content'):
-            content.append(section['content'])
-            content.append("")
+        if content:
+            w(f"{content}\n\n")
         
-        if section.get('key_points'):
-            content.append("   Key Points:")
-            for point in section['key_points']:
-                content.append(f"   - {point}")
-            content.append("")
+        if key_points:
+            w("   Key Points:\n")
+            w("\n".join(f"   - {point}" for point in key_points))
+            w("\n\n")
         
-        if section.get('quotes'):
-            content.append("   Important Quotes:")
-            for quote in section['quotes']:
-                content.append(f'   "{quote}"')
-            content.append("")
+        if quotes:
+            w("   Important Quotes:\n")
+            w("\n".join(f'   "{quote}"' for quote in quotes))
+            w("\n\n")
         
-        content.append("-" * 40)
+        w(divider)
     
-    return "\n".join(content)
\ No newline at end of file
+    # Drop the line break after the last line
+    return buf.getvalue()[:-1]
\ No newline at end of file
@@ -1,6 +1,12 @@
 import streamlit as st
-from datetime import datetime
-from services.rag_system import RAGSystem
+import time
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+from components.navigation import go_to_page
+from services.qa_cache import QACache
+from utils.config import format_timestamp, get_default_suggested_questions, get_processing_limits, widget_key
+from utils.resources import get_rag_system
 
 def qa_page():
     st.title("❓ Q&A Interface")
@@ -8,21 +14,22 @@ def qa_page():
     # Check if RAG system is available
     if not st.session_state.get('vector_store'):
         st.warning("No processed video available. Please process a video first.")
-        if st.button("🔄 Go to Upload"):
-            st.switch_page("upload_page")
+        st.button("🔄 Go to Upload", on_click=go_to_page, args=("Upload Video",))
         return
     
-    # Initialize RAG system
-    rag_system = RAGSystem(api_key=st.session_state.get('groq_api_key'))
+    # Get the cached RAG system
+    rag_system = get_rag_system(st.session_state.get('groq_api_key'))
     
     # Current video info
     display_current_video_info()
     
-    # Question input
+    # Question input, prefilled by follow-up, suggested and re-ask questions
+    _consume_pending_question()
     question = st.text_input(
         "💭 Ask a question about the video:",
         placeholder="What are the main topics discussed in this video?",
-        help="Ask specific questions about the content, concepts, or details from the video"
+        help="Ask specific questions about the content, concepts, or details from the video",
+        key="question_input"
     )
     
     # Question options
@@ -35,6 +42,7 @@ def qa_page():
     with col2:
         max_sources = st.slider("Max Sources", min_value=1, max_value=10, value=3)
         detailed_answer = st.checkbox("Detailed Answer", value=False)
+        no_cache = st.checkbox("Bypass Answer Cache", value=False)
     
     # Ask button
     if st.button("🔍 Ask Question", type="primary", disabled=not question):
@@ -42,7 +50,8 @@ def qa_page():
             'include_timestamps': include_timestamps,
             'include_confidence': include_confidence,
             'max_sources': max_sources,
-            'detailed_answer': detailed_answer
+            'detailed_answer': detailed_answer,
+            'no_cache': no_cache
         })
     
     # Display question history
@@ -51,6 +60,15 @@ def qa_page():
     # Suggested questions
     display_suggested_questions()
 
+def _consume_pending_question():
+    """Move a question queued by the follow-up, suggestion or re-ask buttons into the question input"""
+    for key in ('follow_up_question', 'suggested_question', 'reask_question'):
+        pending = st.session_state.pop(key, None)
+        if pending:
+            # Must be set before the input widget is created in this run
+            st.session_state.question_input = pending
+            return
+
 def display_current_video_info():
     """Display current video information"""
     video_info = st.session_state.get('current_video', {})
@@ -65,35 +83,88 @@ def display_current_video_info():
         with col2:
             notes = st.session_state.get('current_notes', {})
             st.write(f"**Sections**: {len(notes.get('sections', []))}")
-            st.write(f"**Processed**: {video_info.get('processed_at', 'Recently')}")
+            st.write(f"**Processed**: {format_timestamp(video_info.get('processed_at'))}")
+
+def get_qa_cache(options):
+    """Get the semantic answer cache for the current vector store and answer options"""
+    video_id = st.session_state.vector_store.get('video_id')
+    namespace = (video_id, options.get('max_sources'), options.get('detailed_answer'))
+    
+    # Drop caches built against a previous vector store
+    caches = st.session_state.get('qa_semantic_cache') or {}
+    if any(key[0] != video_id for key in caches):
+        caches = {}
+    
+    if namespace not in caches:
+        caches[namespace] = QACache(namespace=namespace)
+    
+    st.session_state.qa_semantic_cache = caches
+    return caches[namespace]
 
 def answer_question(question, rag_system, options):
     """Process question and display answer"""
-    with st.spinner("🤔 Thinking..."):
-        try:
-            # Get answer from RAG system
-            result = rag_system.answer_question(
-                question=question,
-                vector_store=st.session_state.vector_store,
-                options=options
-            )
-            
-            # Display answer
-            display_answer(question, result, options)
+    try:
+        cached = False
+        qa_cache = None
+        query_embedding = None
+        
+        with st.spinner("🤔 Thinking..."):
+            result = None
             
-            # Save to history
-            save_question_to_history(question, result)
+            # Reuse the answer to a near-duplicate question if one is cached
+            if not options.get('no_cache'):
+                qa_cache = get_qa_cache(options)
+                query_embedding = rag_system.embed_query(question)
+                result = qa_cache.lookup(query_embedding)
+                cached = result is not None
             
-        except Exception as e:
-            st.error(f"Error processing question: {str(e)}")
+            if result is None:
+                # Questions about a precomputed concept skip the vector search
+                concept_chunks = rag_system.match_concept(
+                    question,
+                    st.session_state.get('concept_index')
+                )
+                
+                # Retrieve sources now and stream the answer while displaying it
+                result = rag_system.answer_question(
+                    question=question,
+                    vector_store=st.session_state.vector_store,
+                    options=options,
+                    chunks=concept_chunks,
+                    stream=True
+                )
+        
+        if cached:
+            st.caption("⚡ Answered from cache")
+        
+        # Display answer
+        result = display_answer(question, result, options)
+        
+        # Only successful generations are cached; an error reply would be
+        # served to every similar question until it expired
+        if not cached and qa_cache is not None and result.get('sources') and not result.get('error'):
+            qa_cache.add(query_embedding, result)
+        
+        # Save to history once the full answer is known
+        save_question_to_history(question, result)
+        
+    except Exception as e:
+        st.error(f"Error processing question: {str(e)}")
 
 def display_answer(question, result, options):
-    """Display the answer with sources and metadata"""
+    """Display the answer with sources and metadata
+    
+    `result` may be a stream from RAGSystem.answer_question; the complete
+    result is returned once it has been rendered.
+    """
     st.markdown("---")
     st.subheader("📝 Answer")
     
     # Main answer
-    st.write(result.get('answer', 'No answer generated'))
+    if isinstance(result, dict):
+        st.write(result.get('answer', 'No answer generated'))
+    else:
+        result = _write_answer_stream(result)
     
     # Confidence score
     if options.get('include_confidence') and result.get('confidence'):
@@ -128,26 +199,38 @@ def display_answer(question, result, options):
         st.markdown("---")
         st.subheader("💡 Follow-up Questions")
         
-        for follow_up in result['follow_up_questions']:
-            if st.button(f"❓ {follow_up}", key=f"followup_{hash(follow_up)}"):
+        for follow_up in dict.fromkeys(result['follow_up_questions']):
+            if st.button(f"❓ {follow_up}", key=widget_key("followup", follow_up)):
                 st.session_state.follow_up_question = follow_up
                 st.rerun()
+    
+    return result
+
+def _write_answer_stream(stream):
+    """Write streamed answer text as it arrives and return the final result"""
+    result = {}
+    
+    def answer_text():
+        for item in stream:
+            if isinstance(item, dict):
+                result.update(item)
+            else:
+                yield item
+    
+    st.write_stream(answer_text())
+    return result
 
 def save_question_to_history(question, result):
     """Save question and answer to history"""
     if 'qa_history' not in st.session_state:
-        st.session_state.qa_history = []
+        st.session_state.qa_history = deque(maxlen=get_processing_limits()['max_qa_history'])
     
     st.session_state.qa_history.append({
         'question': question,
         'answer': result.get('answer', ''),
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'timestamp': time.time(),
         'sources_count': len(result.get('sources', []))
     })
-    
-    # Keep only last 20 questions
-    if len(st.session_state.qa_history) > 20:
-        st.session_state.qa_history = st.session_state.qa_history[-20:]
 
 def display_question_history():
     """Display previous questions and answers"""
@@ -157,29 +240,37 @@ def display_question_history():
     st.markdown("---")
     st.subheader("📋 Question History")
     
+    history = st.session_state.qa_history
+    
     # History controls
-    col1, col2 = st.columns([3, 1])
+    col1, col2, col3 = st.columns([2, 1, 1])
     
     with col1:
-        show_count = st.slider("Show last N questions", 1, 10, 5)
+        per_page = st.slider("Questions per page", 1, 10, 5)
     
     with col2:
+        page_count = -(-len(history) // per_page)
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1) if page_count > 1 else 1
+    
+    with col3:
         if st.button("🗑️ Clear History"):
-            st.session_state.qa_history = []
+            history.clear()
             st.rerun()
     
-    # Display history
-    history = st.session_state.qa_history[-show_count:]
+    # Display one page of history, most recent first
+    start = (page - 1) * per_page
     
-    for i, item in enumerate(reversed(history)):
-        with st.expander(f"Q{len(history)-i}: {item['question'][:100]}..."):
-            st.write(f"**Question**: {item['question']}")
-            st.write(f"**Answer**: {item['answer']}")
-            st.write(f"**Asked**: {item['timestamp']}")
-            st.write(f"**Sources**: {item['sources_count']}")
+    for offset, item in enumerate(islice(reversed(history), start, start + per_page)):
+        with st.expander(f"Q{len(history) - start - offset}: {item['question'][:100]}..."):
+            st.markdown(
+                f"**Question**: {item['question']}\n\n"
+                f"**Answer**: {item['answer']}\n\n"
+                f"**Asked**: {format_timestamp(item['timestamp'])}\n\n"
+                f"**Sources**: {item['sources_count']}"
+            )
             
             # Re-ask button
-            if st.button(f"🔄 Re-ask", key=f"reask_{i}"):
+            if st.button(f"🔄 Re-ask", key=widget_key("reask", item['question'], item['timestamp'])):
                 st.session_state.reask_question = item['question']
                 st.rerun()
 
@@ -194,70 +285,43 @@ def display_suggested_questions():
     # Display suggestions in columns
     col1, col2 = st.columns(2)
     
-    for i, suggestion in enumerate(suggestions):
+    for i, suggestion in enumerate(dict.fromkeys(suggestions)):
         column = col1 if i % 2 == 0 else col2
         
         with column:
-            if st.button(f"❓ {suggestion}", key=f"suggestion_{i}"):
+            if st.button(f"❓ {suggestion}", key=widget_key("suggestion", suggestion)):
                 st.session_state.suggested_question = suggestion
                 st.rerun()
 
 def generate_suggested_questions():
     """Generate suggested questions based on video content"""
-    notes = st.session_state.get('current_notes', {})
+    notes = st.session_state.get('current_notes') or {}
+    
+    # Only the first 3 section titles and first 2 topics feed the suggestions
+    section_titles = tuple(section.get('title', '') for section in notes.get('sections', [])[:3])
+    topics = tuple(notes.get('topics', [])[:2])
+    
+    return list(_suggest(section_titles, topics))
+
+@lru_cache(maxsize=16)
+def _suggest(section_titles, topics):
+    """Build suggested questions from section titles and key topics"""
     
     # Default suggestions
-    default_suggestions = [
-        "What are the main topics discussed?",
-        "Can you summarize the key points?",
-        "What are the most important takeaways?",
-        "Are there any specific examples mentioned?",
-        "What conclusions were drawn?",
-        "What questions are answered in this video?"
-    ]
+    default_suggestions = get_default_suggested_questions()
     
     # Generate content-specific suggestions
     content_suggestions = []
     
     # Based on sections
-    sections = notes.get('sections', [])
-    if sections:
-        for section in sections[:3]:  # First 3 sections
-            title = section.get('title', '')
-            if title:
-                content_suggestions.append(f"Tell me more about {title}")
+    for title in section_titles:
+        if title:
+            content_suggestions.append(f"Tell me more about {title}")
     
     # Based on key topics
-    topics = notes.get('topics', [])
-    if topics:
-        for topic in topics[:2]:  # First 2 topics
-            content_suggestions.append(f"Explain {topic} in detail")
+    for topic in topics:
+        content_suggestions.append(f"Explain {topic} in detail")
     
     # Combine and return
-    all_suggestions = content_suggestions + default_suggestions
-    return all_suggestions[:8]  # Return first 8 suggestions
-
-# Handle follow-up and re-ask questions
-if st.session_state.get('follow_up_question'):
-    st.text_input(
-        "💭 Follow-up Question:",
-        value=st.session_state.follow_up_question,
-        key="followup_input"
-    )
-    del st.session_state.follow_up_question
-
-if st.session_state.get('suggested_question'):
-    st.text_input(
-        "💭 Suggested Question:",
-        value=st.session_state.suggested_question,
-        key="suggested_input"
-    )
-    del st.session_state.suggested_question
-
-if st.session_state.get('reask_question'):
-    st.text_input(
-        "💭 Re-ask Question:",
-        value=st.session_state.reask_question,
-        key="reask_input"
-    )
-    del st.session_state.reask_question
\ No newline at end of file
+    all_suggestions = content_suggestions + list(default_suggestions)
+    return tuple(all_suggestions[:8])  # Return first 8 suggestions
@@ -1,10 +1,16 @@
 import streamlit as st
-import re
-from urllib.parse import urlparse
-from services.video_processor import VideoProcessor
-from services.transcription_service import TranscriptionService
-from services.notes_generator import NotesGenerator
-from services.rag_system import RAGSystem
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import islice
+from components.navigation import go_to_page
+from utils.config import format_timestamp, get_default_suggested_questions, get_processing_limits, widget_key
+from utils.resources import (
+    get_video_processor,
+    get_transcription_service,
+    get_notes_generator,
+    get_rag_system
+)
 
 def upload_page():
     st.title("📤 Upload Video")
@@ -49,22 +55,8 @@ def upload_page():
     show_recent_uploads()
 
 def validate_url(url):
-    """Validate video URL format"""
-    try:
-        result = urlparse(url)
-        if not all([result.scheme, result.netloc]):
-            return False
-        
-        # Check for supported platforms
-        supported_domains = [
-            'youtube.com', 'youtu.be', 'vimeo.com',
-            'dailymotion.com', 'twitch.tv'
-        ]
-        
-        domain = result.netloc.lower()
-        return any(supported in domain for supported in supported_domains)
-    except:
-        return False
+    """Validate video URL format against the platforms the video processor supports"""
+    return get_video_processor().validate_url(url)
 
 def check_api_keys():
     """Check if required API keys are configured"""
@@ -76,67 +68,112 @@ def process_video(video_url, options):
     status_text = st.empty()
     
     try:
-        # Initialize services
-        video_processor = VideoProcessor()
-        transcription_service = TranscriptionService()
-        notes_generator = NotesGenerator(
-            api_key=st.session_state.groq_api_key
-        )
-        rag_system = RAGSystem(
-            api_key=st.session_state.groq_api_key
-        )
-        
-        # Step 1: Process video metadata
-        status_text.text("📹 Processing video metadata...")
-        progress_bar.progress(20)
-        
-        video_info = video_processor.extract_video_info(video_url)
-        st.session_state.current_video = video_info
-        
-        # Step 2: Transcribe video
-        status_text.text("🎤 Transcribing video...")
-        progress_bar.progress(40)
-        
-        transcript = transcription_service.transcribe_video(
-            video_url,
-            max_duration=st.session_state.get('max_duration', 30)
-        )
-        st.session_state.current_transcript = transcript
-        
-        # Step 3: Generate structured notes
-        status_text.text("📝 Generating structured notes...")
-        progress_bar.progress(60)
-        
-        notes = notes_generator.generate_notes(
-            transcript,
-            video_info,
-            options
-        )
-        st.session_state.current_notes = notes
-        
-        # Step 4: Setup RAG system
+        # Get cached service instances
+        video_processor = get_video_processor()
+        transcription_service = get_transcription_service()
+        notes_generator = get_notes_generator(st.session_state.groq_api_key)
+        rag_system = get_rag_system(st.session_state.groq_api_key)
+        
+        chunk_size = st.session_state.get('chunk_size', 1000)
+        
+        # Blocking work runs in worker threads while this thread keeps the
+        # progress bar moving; Streamlit calls stay on this thread
+        executor = ThreadPoolExecutor(max_workers=2)
+        notes_future = None
+        try:
+            # Step 1: Fetch video metadata in the background
+            status_text.text("📹 Processing video metadata...")
+            progress_bar.progress(20)
+            
+            video_info_future = executor.submit(video_processor.extract_video_info, video_url)
+            
+            # Step 2: Transcribe video while the metadata request is in flight
+            status_text.text("🎤 Transcribing video...")
+            progress_bar.progress(40)
+            
+            transcript_future = executor.submit(
+                transcription_service.transcribe_video,
+                video_url,
+                max_duration=st.session_state.get('max_duration', 30)
+            )
+            transcript = _wait_with_progress(transcript_future, progress_bar, 40, 59)
+            st.session_state.current_transcript = transcript
+            
+            video_info = video_info_future.result()
+            st.session_state.current_video = video_info
+            
+            # Step 3: Generate structured notes in the background
+            status_text.text("📝 Generating structured notes...")
+            progress_bar.progress(60)
+            
+            # Sections arrive on the generator's thread; only count them here
+            sections_ready = []
+            notes_future = notes_generator.submit_notes(
+                transcript,
+                video_info,
+                options,
+                on_section=sections_ready.append
+            )
+            
+            # Step 4: Embed the transcript while the notes are being generated
+            def show_indexing_progress(stored, total):
+                status_text.text(f"🔍 Indexing transcript... {stored}/{total} chunks")
+                progress_bar.progress(60 + int(15 * stored / total))
+            
+            vector_store = rag_system.setup_vector_store(
+                transcript,
+                {},
+                chunk_size=chunk_size,
+                progress_callback=show_indexing_progress
+            )
+            
+            def show_notes_progress():
+                status_text.text(f"📝 Finishing structured notes... {len(sections_ready)} sections so far")
+            
+            show_notes_progress()
+            notes = _wait_with_progress(notes_future, progress_bar, 75, 79, on_tick=show_notes_progress)
+            st.session_state.current_notes = notes
+        finally:
+            # Don't block on abandoned work when the run is stopped or fails
+            executor.shutdown(wait=False, cancel_futures=True)
+            if notes_future is not None:
+                notes_future.cancel()
+        
+        # Add the notes to the search system
         status_text.text("🔍 Setting up search system...")
         progress_bar.progress(80)
         
-        vector_store = rag_system.setup_vector_store(
-            transcript,
+        vector_store = rag_system.add_notes_to_vector_store(
+            vector_store,
             notes,
-            chunk_size=st.session_state.get('chunk_size', 1000)
+            chunk_size=chunk_size
         )
         st.session_state.vector_store = vector_store
         
+        # Pre-resolve retrieval for section titles, topics and suggested questions
+        st.session_state.concept_index = rag_system.build_concept_index(
+            vector_store,
+            notes,
+            get_default_suggested_questions()
+        )
+        
         # Step 5: Complete
         progress_bar.progress(100)
         status_text.text("✅ Processing complete!")
         
-        # Update processed videos list
-        if 'processed_videos' not in st.session_state:
-            st.session_state.processed_videos = []
-        
+        # Update processed videos list, keeping one entry per URL so recent
+        # uploads have unique widget keys
+        st.session_state.processed_videos = deque(
+            (
+                video for video in st.session_state.get('processed_videos', ())
+                if video.get('url') != video_url
+            ),
+            maxlen=get_processing_limits()['max_processed_videos']
+        )
         st.session_state.processed_videos.append({
             'url': video_url,
             'title': video_info.get('title', 'Unknown'),
-            'processed_at': str(st.session_state.get('current_time', 'Now'))
+            'processed_at': time.time()
         })
         
         st.success(f"Video processed successfully! Generated {len(notes.get('sections', []))} sections.")
@@ -151,28 +188,38 @@ def process_video(video_url, options):
         # Navigation buttons
         col1, col2 = st.columns(2)
         with col1:
-            if st.button("📄 View Notes"):
-                st.switch_page("notes_page")
+            st.button("📄 View Notes", on_click=go_to_page, args=("View Notes",))
         with col2:
-            if st.button("❓ Ask Questions"):
-                st.switch_page("qa_page")
+            st.button("❓ Ask Questions", on_click=go_to_page, args=("Q&A",))
         
     except Exception as e:
         status_text.text(f"❌ Error: {str(e)}")
         st.error(f"Processing failed: {str(e)}")
         progress_bar.empty()
 
+def _wait_with_progress(future, progress_bar, start, limit, on_tick=None):
+    """Wait for a background step, advancing the progress bar towards `limit` meanwhile"""
+    progress = start
+    while True:
+        try:
+            return future.result(timeout=0.5)
+        except FutureTimeoutError:
+            progress = min(progress + 1, limit)
+            progress_bar.progress(progress)
+            if on_tick:
+                on_tick()
+
 def show_recent_uploads():
     """Display recent video uploads"""
     if st.session_state.get('processed_videos'):
         st.subheader("📋 Recent Uploads")
         
-        for i, video in enumerate(reversed(st.session_state.processed_videos[-5:])):
+        for i, video in enumerate(islice(reversed(st.session_state.processed_videos), 5)):
             with st.expander(f"📹 {video['title']}"):
                 st.write(f"**URL**: {video['url']}")
-                st.write(f"**Processed**: {video['processed_at']}")
+                st.write(f"**Processed**: {format_timestamp(video['processed_at'])}")
                 
-                if st.button(f"Load Video {i+1}", key=f"load_{i}"):
+                if st.button(f"Load Video {i+1}", key=widget_key("load", video['url'])):
                     # Load this video as current
                     st.session_state.current_video = video
                     st.success(f"Loaded: {video['title']}")
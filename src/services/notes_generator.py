@@ -1,245 +1,956 @@
-from groq import Groq
-from typing import Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+import asyncio
+import copy
+import hashlib
 import json
 import re
-from datetime import datetime
+import threading
+import weakref
+from concurrent.futures import Future
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from services.qa_cache import QACache
+from utils.cache import CacheManager, cached_llm
+
+T = TypeVar('T')
+
+# Transcript passage length used when embedding a whole transcript
+TRANSCRIPT_PASSAGE_CHARS = 1000
+
+# Long transcripts are split into chunks of about this many tokens, estimated
+# at four characters per token for English text
+MAP_CHUNK_TOKENS = 2500
+CHARS_PER_TOKEN = 4
+
+# Context window of the notes model, and room left for the chat template
+CONTEXT_WINDOW_TOKENS = 128000
+CONTEXT_MARGIN_TOKENS = 128
+
+# Output budget for structured notes: about as long as the transcript they
+# cover, within these bounds
+NOTES_MIN_TOKENS = 1000
+NOTES_MAX_TOKENS = 4000
+
+# Upper bound on LLM requests in flight at once, to stay clear of rate limits
+MAX_CONCURRENT_REQUESTS = 4
+
+# Attempts the client makes on rate limits, server errors and dropped
+# connections, with jittered exponential backoff between them
+MAX_RETRIES = 5
+
+# Terminal states of a provider batch job
+BATCH_FINAL_STATES = frozenset({'completed', 'failed', 'expired', 'cancelled'})
+
+# Requests about one transcript share a prefix: the static system prompt, then
+# the transcript, then the instruction for the kind of response. Provider-side
+# prompt caching can then reuse the transcript across notes, summary,
+# takeaways and Q&A requests
+NOTES_SYSTEM_PROMPT = """You are an expert content analyzer and note-taker. Your task is to transform a video transcript into well-structured, comprehensive notes. Follow these guidelines:
+
+1. Identify the main topics and subtopics
+2. Create a hierarchical structure with clear headings
+3. Extract key quotes and important statements
+4. Summarize complex sections concisely
+5. Highlight definitions, examples, and important concepts
+6. Include timestamps for easy reference
+7. Maintain the original meaning and intent
+8. Format the notes for readability
+9. For technical content, preserve accuracy of terms and concepts
+10. For educational content, organize in a learning-friendly sequence
+
+The notes should be comprehensive yet focused, eliminating filler content while preserving all valuable information.
+"""
+
+NOTES_USER_PROMPT = """Please analyze the video transcript above and create structured notes.
+
+Please provide the output in JSON format with the following structure:
+{
+    "sections": [
+        {
+            "title": "Section Title",
+            "timestamp": "00:00",
+            "content": "Main content summary",
+            "key_points": ["Point 1", "Point 2"],
+            "quotes": ["Important quote 1", "Important quote 2"],
+            "concepts": ["Concept 1", "Concept 2"],
+            "examples": ["Example 1", "Example 2"]
+        }
+    ],
+    "topics": ["Topic 1", "Topic 2", "Topic 3"],
+    "main_theme": "Overall theme of the video",
+    "learning_objectives": ["Objective 1", "Objective 2"]
+}
+"""
+
+NOTES_VIDEO_TEMPLATE = """Video Title: {title}
+Duration: {duration}
+Platform: {platform}
+
+Transcript:
+{transcript}
+"""
+
+SUMMARY_PROMPT = """Please provide a concise summary (2-3 paragraphs) of the video transcript above.
+Focus on the main points, key insights, and overall message.
+"""
+
+KEY_TAKEAWAYS_PROMPT = """Please extract 5-8 key takeaways from the video transcript above.
+Format as a JSON object with an "items" array of strings. Each takeaway should be a concise, actionable insight.
+"""
+
+REDUCE_NOTES_PROMPT = """The notes for a long video were written in consecutive parts. Using the outline of each part below, describe the video as a whole.
+
+Please provide the output in JSON format with the following structure:
+{
+    "topics": ["Topic 1", "Topic 2", "Topic 3"],
+    "main_theme": "Overall theme of the video",
+    "learning_objectives": ["Objective 1", "Objective 2"]
+}
+
+Outline:
+"""
+
+QA_PAIRS_PROMPT = """Please generate 5-8 question-answer pairs based on the video transcript above.
+Format as a JSON object with an "items" array of objects with "question" and "answer" fields.
+Questions should cover important concepts and key information.
+"""
+
+# Replies requested in JSON mode are a bare JSON object. The provider does not
+# support JSON mode on streamed requests
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Content types in priority order, with the theme keywords that identify them
+CONTENT_TYPE_KEYWORDS = (
+    ('Tutorial', ('tutorial', 'how to', 'guide', 'learn')),
+    ('Educational', ('lecture', 'education', 'course')),
+    ('News/Information', ('news', 'update', 'report')),
+    ('Interview/Discussion', ('interview', 'discussion', 'talk')),
+    ('Review/Analysis', ('review', 'analysis', 'opinion'))
+)
+
+# One alternation over every keyword; group `type<i>` matches CONTENT_TYPE_KEYWORDS[i]
+CONTENT_TYPE_RE = re.compile('|'.join(
+    f"(?P<type{i}>{'|'.join(map(re.escape, keywords))})"
+    for i, (_, keywords) in enumerate(CONTENT_TYPE_KEYWORDS)
+))
+
+# Start of the sections array in a structured notes reply
+SECTIONS_ARRAY_RE = re.compile(r'"sections"\s*:\s*\[')
+
+# JSON payload wrapped in a markdown code block
+JSON_BLOCK_RE = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+
+# [MM:SS] markers in prepared transcript text
+TIMESTAMP_RE = re.compile(r'\[(\d{2}:\d{2})\]')
+
+# Bullet or numbered list marker at the start of a line
+LIST_MARKER_RE = re.compile(r'^(?:[\-\*\•]|\d+\.)\s+')
+
+class SectionStreamParser:
+    """Extract completed section objects from a structured notes reply as it streams in"""
+    
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._start = 0
+        self._in_string = False
+        self._escaped = False
+    
+    @property
+    def text(self) -> str:
+        """All text received so far"""
+        return self._text
+    
+    def feed(self, delta: str) -> List[Dict]:
+        """Add streamed text and return the sections completed by it"""
+        
+        self._text += delta
+        if self._done:
+            return []
+        
+        text = self._text
+        
+        if not self._in_array:
+            match = SECTIONS_ARRAY_RE.search(text)
+            if not match:
+                return []
+            self._in_array = True
+            self._pos = match.end()
+        
+        # Track object nesting, ignoring braces inside strings, from where the
+        # previous call stopped
+        sections = []
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        sections.append(json.loads(text[self._start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+            elif ch == ']' and self._depth == 0:
+                self._done = True
+                break
+            i += 1
+        
+        self._pos = i
+        return sections
+
+# Tasks of the LLM calls that fell back while generating the current response;
+# set by _cached_response so degraded output is never cached
+_llm_fallbacks: ContextVar[Optional[List[str]]] = ContextVar('llm_fallbacks', default=None)
+
+class ParseFallback(Exception):
+    """Raised by a reply parser that could only salvage a degraded `result` from the reply"""
+    
+    def __init__(self, result: Any, reason: str):
+        super().__init__(reason)
+        self.result = result
+
+def _report_fallback(task: str):
+    """Record a fallback with the enclosing _cached_response, if any"""
+    fallbacks = _llm_fallbacks.get()
+    if fallbacks is not None:
+        fallbacks.append(task)
 
 class NotesGenerator:
     """Generate structured notes from video transcripts using LLM"""
     
-    def __init__(self, api_key: str):
-        self.client = Groq(api_key=api_key)
+    def __init__(self, api_key: str, embedding_model: Any = None, semantic_threshold: float = 0.95,
+                 cache: Optional[CacheManager] = None):
+        # Imported here so helpers like validate_notes_structure don't pay for
+        # loading the client library
+        from groq import AsyncGroq
+        
+        # One client for every request, so its connection pool is reused
+        self.client = AsyncGroq(api_key=api_key, max_retries=MAX_RETRIES)
         self.model = "llama-3.3-70b-versatile"
+        
+        # Exact-match cache for LLM completions; None disables it
+        self.cache = cache
+        
+        # Responses for near-identical transcripts are reused when an embedding
+        # model is available, with one cache per kind of response
+        self.embedding_model = embedding_model
+        self.semantic_threshold = semantic_threshold
+        self._semantic_caches: Dict[str, QACache] = {}
+        
+        # Event loop that owns the async client's connections, started on first use
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        
+        # Concurrency limit per event loop; a semaphore only works on the loop
+        # it was first used on, and callers may await from their own loop
+        self._request_slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+    
+    def generate_notes(self, transcript: Dict, video_info: Dict, options: Dict,
+                       on_section: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Generate structured notes from transcript
+        
+        `on_section` is called with each section as soon as it is available; it
+        runs on the generator's event loop thread.
+        """
+        return self._run(self.agenerate_notes(transcript, video_info, options, on_section))
     
-    def generate_notes(self, transcript: Dict, video_info: Dict, options: Dict) -> Dict:
-        """Generate structured notes from transcript"""
+    def submit_notes(self, transcript: Dict, video_info: Dict, options: Dict,
+                     on_section: Optional[Callable[[Dict], None]] = None) -> Future:
+        """Start generating notes without blocking and return a future for them
+        
+        Takes the same arguments as generate_notes. Cancelling the future
+        cancels the outstanding requests.
+        """
+        return self._submit(self.agenerate_notes(transcript, video_info, options, on_section))
+    
+    async def agenerate_notes(self, transcript: Dict, video_info: Dict, options: Dict,
+                              on_section: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Generate structured notes from transcript, issuing independent LLM calls concurrently"""
         
         # Prepare the transcript text
         transcript_text = self._prepare_transcript_text(transcript)
         
-        # Generate main notes
-        structured_notes = self._generate_structured_notes(
-            transcript_text, 
-            video_info, 
-            options
+        transcript_embedding = await self._embed_transcript(transcript_text)
+        source = self._source_key(transcript_text, video_info)
+        
+        # Count sections delivered while streaming so cached or fallback notes
+        # can deliver the rest afterwards
+        delivered = 0
+        
+        def deliver(section):
+            nonlocal delivered
+            delivered += 1
+            if on_section:
+                on_section(section)
+        
+        # Main notes and the optional extras only depend on the transcript
+        calls = {'notes': self._cached_response(
+            'structured_notes', transcript_embedding, source,
+            lambda: self._generate_structured_notes(
+                transcript_text, video_info, options,
+                on_section=deliver if on_section else None
+            )
+        )}
+        
+        if options.get('generate_summary'):
+            calls['summary'] = self._cached_response(
+                'summary', transcript_embedding, source,
+                lambda: self._generate_summary(transcript_text, video_info)
+            )
+        
+        if options.get('extract_key_points'):
+            calls['key_takeaways'] = self._cached_response(
+                'key_takeaways', transcript_embedding, source,
+                lambda: self._extract_key_takeaways(transcript_text, video_info)
+            )
+        
+        if options.get('create_qa_pairs'):
+            calls['qa_pairs'] = self._cached_response(
+                'qa_pairs', transcript_embedding, source,
+                lambda: self._generate_qa_pairs(transcript_text, video_info)
+            )
+        
+        results = dict(zip(calls, await asyncio.gather(*calls.values())))
+        structured_notes = results.pop('notes')
+        
+        if on_section:
+            for section in structured_notes.get('sections', [])[delivered:]:
+                deliver(section)
+        
+        return self._finalize_notes(
+            structured_notes, results, transcript, video_info, options, self._processed_at()
+        )
+    
+    def generate_notes_batch(self, jobs: List[Dict], poll_interval: float = 10.0) -> List[Dict]:
+        """Generate notes for many videos through the provider's batch API
+        
+        Each job holds the `transcript`, `video_info` and `options` arguments of
+        generate_notes. Results are returned in job order.
+        """
+        return self._run(self.agenerate_notes_batch(jobs, poll_interval))
+    
+    async def agenerate_notes_batch(self, jobs: List[Dict], poll_interval: float = 10.0) -> List[Dict]:
+        """Generate notes for many videos through the provider's batch API, falling back to direct calls"""
+        
+        # One request per job and kind of response, as (messages, temperature, max_tokens, json_mode)
+        job_requests = []
+        for job in jobs:
+            transcript_text = self._prepare_transcript_text(job['transcript'])
+            options = job.get('options', {})
+            
+            video_info = job['video_info']
+            
+            requests = {'notes': (
+                self._notes_messages(transcript_text, video_info), 0.3, self._notes_max_tokens(transcript_text), True
+            )}
+            
+            if options.get('generate_summary'):
+                requests['summary'] = (
+                    self._transcript_messages(transcript_text, video_info, SUMMARY_PROMPT), 0.3, 500, False
+                )
+            
+            if options.get('extract_key_points'):
+                requests['key_takeaways'] = (
+                    self._transcript_messages(transcript_text, video_info, KEY_TAKEAWAYS_PROMPT), 0.3, 800, True
+                )
+            
+            if options.get('create_qa_pairs'):
+                requests['qa_pairs'] = (
+                    self._transcript_messages(transcript_text, video_info, QA_PAIRS_PROMPT), 0.4, 1200, True
+                )
+            
+            job_requests.append(requests)
+        
+        try:
+            replies = await self._run_batch({
+                f"{i}:{kind}": request
+                for i, requests in enumerate(job_requests)
+                for kind, request in requests.items()
+            }, poll_interval)
+        except Exception as e:
+            print(f"Batch processing unavailable, generating notes directly: {e}")
+            replies = {}
+        
+        # Jobs completed by the batch share one timestamp
+        processed_at = self._processed_at()
+        
+        parsers = {
+            'notes': self._parse_structured_notes,
+            'summary': str.strip,
+            'key_takeaways': self._parse_key_takeaways,
+            'qa_pairs': self._parse_qa_pairs
+        }
+        
+        results: List[Optional[Dict]] = [None] * len(jobs)
+        for i, (job, requests) in enumerate(zip(jobs, job_requests)):
+            contents = {kind: replies.get(f"{i}:{kind}") for kind in requests}
+            if None in contents.values():
+                continue
+            
+            try:
+                parsed = {kind: parsers[kind](content) for kind, content in contents.items()}
+            except ParseFallback as e:
+                # Retried directly rather than kept degraded
+                print(f"Error parsing batch reply for job {i}: {e}")
+                continue
+            
+            results[i] = self._finalize_notes(
+                parsed.pop('notes'), parsed, job['transcript'], job['video_info'], job.get('options', {}),
+                processed_at
+            )
+        
+        # Jobs with missing, failed or unparseable replies go through the direct path
+        missing = [i for i, result in enumerate(results) if result is None]
+        direct = await asyncio.gather(*[
+            self.agenerate_notes(
+                transcript=jobs[i]['transcript'],
+                video_info=jobs[i]['video_info'],
+                options=jobs[i].get('options', {})
+            )
+            for i in missing
+        ])
+        for i, notes in zip(missing, direct):
+            results[i] = notes
+        
+        return results
+    
+    async def _run_batch(self, requests: Dict[str, tuple], poll_interval: float) -> Dict[str, str]:
+        """Submit chat completions as one batch job and return the reply text by request id"""
+        
+        lines = [
+            json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": self._fit_max_tokens(messages, max_tokens),
+                    **({"response_format": JSON_RESPONSE_FORMAT} if json_mode else {})
+                }
+            }, separators=(',', ':'))
+            for custom_id, (messages, temperature, max_tokens, json_mode) in requests.items()
+        ]
+        
+        batch_file = await self.client.files.create(
+            file=("notes_batch.jsonl", '\n'.join(lines).encode()),
+            purpose="batch"
         )
+        batch = await self.client.batches.create(
+            completion_window="24h",
+            endpoint="/v1/chat/completions",
+            input_file_id=batch_file.id
+        )
+        
+        # Poll with exponential backoff until the job finishes
+        delay = poll_interval
+        while batch.status not in BATCH_FINAL_STATES:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 300)
+            batch = await self.client.batches.retrieve(batch.id)
+        
+        if not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch.id} finished as {batch.status} without output")
+        
+        output = await self.client.files.content(batch.output_file_id)
+        
+        replies = {}
+        for line in (await output.text()).splitlines():
+            if not line.strip():
+                continue
+            
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if response.get('status_code') == 200:
+                replies[record['custom_id']] = response['body']['choices'][0]['message']['content']
+        
+        return replies
+    
+    def _finalize_notes(self, structured_notes: Dict, extras: Dict, transcript: Dict,
+                        video_info: Dict, options: Dict, processed_at: str) -> Dict:
+        """Attach metadata and optional extras to generated notes"""
         
         # Add metadata
         structured_notes['metadata'] = {
             'video_title': video_info.get('title', 'Unknown'),
             'video_duration': video_info.get('duration', 'Unknown'),
             'video_platform': video_info.get('platform', 'Unknown'),
-            'processed_at': datetime.now().isoformat(),
+            'processed_at': processed_at,
             'transcript_source': transcript.get('source', 'Unknown'),
             'word_count': transcript.get('word_count', 0),
             'options_used': options
         }
         
-        # Generate additional content based on options
-        if options.get('generate_summary'):
-            structured_notes['summary'] = self._generate_summary(transcript_text)
+        # Add additional content based on options
+        structured_notes.update(extras)
         
-        if options.get('extract_key_points'):
-            structured_notes['key_takeaways'] = self._extract_key_takeaways(transcript_text)
+        return structured_notes
+    
+    def _processed_at(self) -> str:
+        """Timestamp for the notes metadata, in UTC"""
+        return datetime.now(timezone.utc).isoformat()
+    
+    def _run(self, coro: Awaitable[T]) -> T:
+        """Run a coroutine on the generator's event loop and wait for its result"""
+        return self._submit(coro).result()
+    
+    def _submit(self, coro: Awaitable[T]) -> Future:
+        """Schedule a coroutine on the generator's event loop"""
         
-        if options.get('create_qa_pairs'):
-            structured_notes['qa_pairs'] = self._generate_qa_pairs(transcript_text)
+        # A single long-lived loop lets the async client reuse its connections
+        # across calls from any thread
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="notes-generator-loop",
+                    daemon=True
+                ).start()
         
-        return structured_notes
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
     
-    def _prepare_transcript_text(self, transcript: Dict) -> str:
-        """Prepare transcript text for processing"""
+    async def _embed_transcript(self, transcript_text: str) -> Optional[Any]:
+        """Embed a whole transcript as the mean of its passage embeddings"""
         
-        # Use segments if available for better structure
-        if 'segments' in transcript and transcript['segments']:
-            formatted_segments = []
-            for segment in transcript['segments']:
-                timestamp = segment.get('start', '00:00')
-                text = segment.get('text', '')
-                speaker = segment.get('speaker', '')
-                
-                if speaker:
-                    formatted_segments.append(f"[{timestamp}] {speaker}: {text}")
-                else:
-                    formatted_segments.append(f"[{timestamp}] {text}")
-            
-            return '\n\n'.join(formatted_segments)
+        if self.embedding_model is None:
+            return None
         
-        # Fallback to full text
-        return transcript.get('full_text', '')
+        # The model only reads the first few hundred tokens of an input, so
+        # embed fixed-size passages to cover the full transcript
+        passages = [
+            transcript_text[i:i + TRANSCRIPT_PASSAGE_CHARS]
+            for i in range(0, len(transcript_text), TRANSCRIPT_PASSAGE_CHARS)
+        ] or ['']
+        
+        def encode():
+            return self.embedding_model.encode(passages, batch_size=64, normalize_embeddings=True).mean(axis=0)
+        
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, encode)
+        except Exception as e:
+            print(f"Error embedding transcript: {e}")
+            return None
     
-    def _generate_structured_notes(self, transcript_text: str, video_info: Dict, options: Dict) -> Dict:
-        """Generate the main structured notes"""
+    def _source_key(self, transcript_text: str, video_info: Dict) -> str:
+        """Identify the video a transcript came from, for scoping the semantic cache"""
         
-        system_prompt = """
-        You are an expert content analyzer and note-taker. Your task is to transform a video transcript into well-structured, comprehensive notes. Follow these guidelines:
-
-        1. Identify the main topics and subtopics
-        2. Create a hierarchical structure with clear headings
-        3. Extract key quotes and important statements
-        4. Summarize complex sections concisely
-        5. Highlight definitions, examples, and important concepts
-        6. Include timestamps for easy reference
-        7. Maintain the original meaning and intent
-        8. Format the notes for readability
-        9. For technical content, preserve accuracy of terms and concepts
-        10. For educational content, organize in a learning-friendly sequence
-
-        The notes should be comprehensive yet focused, eliminating filler content while preserving all valuable information.
+        video_id = video_info.get('video_id')
+        if video_id and video_id != 'Unknown':
+            return f"{video_info.get('platform', 'Unknown')}:{video_id}"
+        
+        # Without a video ID only the same transcript counts as the same video
+        return hashlib.blake2b(transcript_text.encode(), digest_size=16).hexdigest()
+    
+    async def _cached_response(self, kind: str, embedding: Optional[Any], source: str,
+                               generate: Callable[[], Awaitable[T]]) -> T:
+        """Reuse the response generated for a near-identical transcript of the same video,
+        or generate one and cache it unless any of its LLM calls fell back
         """
         
-        user_prompt = f"""
-        Please analyze the following video transcript and create structured notes:
-
-        Video Title: {video_info.get('title', 'Unknown')}
-        Duration: {video_info.get('duration', 'Unknown')}
-        Platform: {video_info.get('platform', 'Unknown')}
-
-        Transcript:
-        {transcript_text}
-
-        Please provide the output in JSON format with the following structure:
-        {{
-            "sections": [
-                {{
-                    "title": "Section Title",
-                    "timestamp": "00:00",
-                    "content": "Main content summary",
-                    "key_points": ["Point 1", "Point 2"],
-                    "quotes": ["Important quote 1", "Important quote 2"],
-                    "concepts": ["Concept 1", "Concept 2"],
-                    "examples": ["Example 1", "Example 2"]
-                }}
-            ],
-            "topics": ["Topic 1", "Topic 2", "Topic 3"],
-            "main_theme": "Overall theme of the video",
-            "learning_objectives": ["Objective 1", "Objective 2"]
-        }}
+        if embedding is None:
+            return await generate()
+        
+        cache = self._semantic_caches.get(kind)
+        if cache is None:
+            cache = self._semantic_caches[kind] = QACache(
+                namespace=(self.model, kind),
+                threshold=self.semantic_threshold,
+                ttl=24 * 60 * 60,
+                max_entries=64
+            )
+        
+        # Similar transcripts of different videos (e.g. a lecture series) must
+        # not share responses, so entries are tagged with their source
+        cached = cache.lookup(embedding)
+        if cached is not None and cached['source'] == source:
+            # Callers mutate the notes they get back, so the cache keeps its own copy
+            return copy.deepcopy(cached['result'])
+        
+        # Child tasks inherit the list, so fallbacks in map-reduce calls count too
+        fallbacks = []
+        token = _llm_fallbacks.set(fallbacks)
+        try:
+            result = await generate()
+        finally:
+            _llm_fallbacks.reset(token)
+        
+        if not fallbacks:
+            cache.add(embedding, {'source': source, 'result': copy.deepcopy(result)})
+        return result
+    
+    async def _call_llm(self, messages: List[Dict], parser: Callable[[str], T], fallback: Callable[[], T],
+                        task: str, temperature: float = 0.3, max_tokens: int = 500,
+                        on_delta: Optional[Callable[[str], None]] = None, json_mode: bool = False) -> T:
+        """Run a chat completion and parse the reply, returning `fallback()` if either step fails
+        
+        `task` describes the call in the error log, e.g. "generating summary".
+        Fallbacks, including results a parser only salvaged, are also reported
+        to the enclosing _cached_response, if any.
         """
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3,
-                max_tokens=4000
+            result = await self._parsed_completion(
+                task=task,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                parser=parser,
+                on_delta=on_delta,
+                json_mode=json_mode
             )
             
-            # Parse the JSON response
-            content = response.choices[0].message.content
+            # The exact-match cache may hand back the object it holds, and
+            # callers mutate the notes they get
+            return copy.deepcopy(result)
             
-            # Extract JSON from response (handle markdown code blocks)
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', content, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Try to find JSON without code blocks
-                json_str = content
+        except ParseFallback as e:
+            print(f"Error {task}: {e}")
+            _report_fallback(task)
+            return e.result
             
-            try:
-                structured_notes = json.loads(json_str)
-                return structured_notes
-            except json.JSONDecodeError:
-                # Fallback to manual parsing
-                return self._parse_notes_fallback(content)
-                
         except Exception as e:
-            print(f"Error generating structured notes: {e}")
-            return self._create_fallback_notes(transcript_text, video_info)
+            print(f"Error {task}: {e}")
+            _report_fallback(task)
+            return fallback()
     
-    def _generate_summary(self, transcript_text: str) -> str:
-        """Generate a concise summary"""
+    def _loop_request_slots(self) -> asyncio.Semaphore:
+        """Get the request semaphore for the running event loop, creating it on first use"""
         
-        prompt = f"""
-        Please provide a concise summary (2-3 paragraphs) of the following video transcript:
-
-        {transcript_text}
-
-        Focus on the main points, key insights, and overall message.
+        loop = asyncio.get_running_loop()
+        slots = self._request_slots.get(loop)
+        if slots is None:
+            slots = self._request_slots[loop] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        return slots
+    
+    @cached_llm(ttl=24*60*60)
+    async def _parsed_completion(self, task: str, messages: List[Dict], temperature: float, max_tokens: int,
+                                 parser: Callable[[str], T], on_delta: Optional[Callable[[str], None]] = None,
+                                 json_mode: bool = False) -> T:
+        """Run a chat completion and return the parsed reply
+        
+        The parsed result is what gets cached, so a reply that raises in
+        `parser`, including a ParseFallback, is never cached and is requested
+        again next time.
+        """
+        content = await self._complete(messages, temperature, max_tokens, on_delta=on_delta, json_mode=json_mode)
+        return parser(content)
+    
+    async def _complete(self, messages: List[Dict], temperature: float, max_tokens: int,
+                        on_delta: Optional[Callable[[str], None]] = None, json_mode: bool = False) -> str:
+        """Run a chat completion and return the response text
+        
+        With `on_delta`, the response is streamed and each text delta is passed
+        to it as it arrives. With `json_mode`, the reply is constrained to a JSON
+        object; it only applies to unstreamed requests.
         """
         
-        try:
-            response = self.client.chat.completions.create(
+        max_tokens = self._fit_max_tokens(messages, max_tokens)
+        
+        async with self._loop_request_slots():
+            if on_delta is None:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    **({"response_format": JSON_RESPONSE_FORMAT} if json_mode else {})
+                )
+                
+                return response.choices[0].message.content
+            
+            stream = await self.client.chat.completions.create(
                 model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-                max_tokens=500
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
             )
             
-            return response.choices[0].message.content.strip()
+            parts = []
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
             
-        except Exception as e:
-            print(f"Error generating summary: {e}")
-            return "Summary generation failed. Please review the full transcript."
+            return ''.join(parts)
     
-    def _extract_key_takeaways(self, transcript_text: str) -> List[str]:
-        """Extract key takeaways from the transcript"""
+    def _estimate_tokens(self, text: str) -> int:
+        """Estimate the token count of a text"""
+        return len(text) // CHARS_PER_TOKEN + 1
+    
+    def _notes_max_tokens(self, transcript_text: str) -> int:
+        """Size the structured notes output budget to the transcript"""
+        return min(NOTES_MAX_TOKENS, max(NOTES_MIN_TOKENS, self._estimate_tokens(transcript_text)))
+    
+    def _fit_max_tokens(self, messages: List[Dict], max_tokens: int) -> int:
+        """Lower `max_tokens` when the prompt leaves less room than that in the context window"""
         
-        prompt = f"""
-        Please extract 5-8 key takeaways from the following video transcript:
-
-        {transcript_text}
-
-        Format as a JSON array of strings. Each takeaway should be a concise, actionable insight.
-        """
+        prompt_tokens = sum(self._estimate_tokens(message['content']) for message in messages)
+        available = CONTEXT_WINDOW_TOKENS - CONTEXT_MARGIN_TOKENS - prompt_tokens
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-                max_tokens=800
+        if available < max_tokens:
+            print(f"Prompt of ~{prompt_tokens} tokens leaves {available} for the reply; "
+                  f"lowering max_tokens from {max_tokens}")
+            return max(available, 1)
+        
+        return max_tokens
+    
+    def _prepare_transcript_text(self, transcript: Dict) -> str:
+        """Prepare transcript text for processing"""
+        
+        # Use segments if available for better structure
+        segments = transcript.get('segments')
+        if segments:
+            return '\n\n'.join(
+                f"[{segment.get('start', '00:00')}] {speaker}: {segment.get('text', '')}"
+                if (speaker := segment.get('speaker'))
+                else f"[{segment.get('start', '00:00')}] {segment.get('text', '')}"
+                for segment in segments
             )
+        
+        # Fallback to full text
+        return transcript.get('full_text', '')
+    
+    async def _generate_structured_notes(self, transcript_text: str, video_info: Dict, options: Dict,
+                                         on_section: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Generate the main structured notes, mapping long transcripts over chunks"""
+        
+        chunks = self._chunk_transcript(transcript_text)
+        if len(chunks) == 1:
+            return await self._generate_chunk_notes(transcript_text, video_info, options, on_section)
+        
+        # Only the first chunk streams its sections, so they arrive in order;
+        # the rest are delivered once the notes are merged
+        chunk_notes = await asyncio.gather(*[
+            self._generate_chunk_notes(chunk, video_info, options, on_section if i == 0 else None)
+            for i, chunk in enumerate(chunks)
+        ])
+        
+        return await self._reduce_notes(chunk_notes)
+    
+    def _chunk_transcript(self, transcript_text: str, target_tokens: int = MAP_CHUNK_TOKENS) -> List[str]:
+        """Split a transcript on segment boundaries into chunks of roughly `target_tokens`"""
+        
+        target_chars = target_tokens * CHARS_PER_TOKEN
+        chunks = []
+        current = []
+        size = 0
+        
+        for paragraph in transcript_text.split('\n\n'):
+            if current and size + len(paragraph) > target_chars:
+                chunks.append('\n\n'.join(current))
+                current = []
+                size = 0
             
-            content = response.choices[0].message.content.strip()
-            
-            # Try to parse as JSON
-            try:
-                takeaways = json.loads(content)
-                return takeaways if isinstance(takeaways, list) else []
-            except json.JSONDecodeError:
-                # Extract from text format
-                return self._extract_list_from_text(content)
-                
-        except Exception as e:
-            print(f"Error extracting key takeaways: {e}")
-            return ["Key takeaways extraction failed"]
+            current.append(paragraph)
+            size += len(paragraph) + 2
+        
+        chunks.append('\n\n'.join(current))
+        return chunks
     
-    def _generate_qa_pairs(self, transcript_text: str) -> List[Dict]:
-        """Generate Q&A pairs from the transcript"""
+    async def _reduce_notes(self, chunk_notes: List[Dict]) -> Dict:
+        """Merge notes generated for consecutive transcript chunks"""
         
-        prompt = f"""
-        Please generate 5-8 question-answer pairs based on the following video transcript:
-
-        {transcript_text}
-
-        Format as a JSON array of objects with "question" and "answer" fields.
-        Questions should cover important concepts and key information.
+        # Sections are kept as they are; overall fields default to the union of the parts
+        merged = {
+            "sections": [section for notes in chunk_notes for section in notes.get('sections', [])],
+            "topics": list(dict.fromkeys(
+                topic for notes in chunk_notes for topic in notes.get('topics', [])
+            )),
+            "main_theme": chunk_notes[0].get('main_theme', ''),
+            "learning_objectives": list(dict.fromkeys(
+                objective for notes in chunk_notes for objective in notes.get('learning_objectives', [])
+            ))
+        }
+        
+        # Ask for the overall fields from a short outline instead of the full notes
+        outline = [
+            {
+                "main_theme": notes.get('main_theme', ''),
+                "topics": notes.get('topics', []),
+                "section_titles": [section.get('title', '') for section in notes.get('sections', [])]
+            }
+            for notes in chunk_notes
+        ]
+        
+        def parse_overall(content):
+            overall = json.loads(self._extract_json_text(content))
+            return {
+                key: overall[key]
+                for key in ('topics', 'main_theme', 'learning_objectives')
+                if overall.get(key)
+            }
+        
+        merged.update(await self._call_llm(
+            [
+                {"role": "system", "content": NOTES_SYSTEM_PROMPT},
+                {"role": "user", "content": REDUCE_NOTES_PROMPT + json.dumps(outline, separators=(',', ':'))}
+            ],
+            parser=parse_overall,
+            fallback=dict,
+            task="merging notes",
+            max_tokens=800,
+            json_mode=True
+        ))
+        
+        return merged
+    
+    def _extract_json_text(self, content: str) -> str:
+        """Get the JSON payload of a reply, unwrapping a markdown code block if present"""
+        
+        json_match = JSON_BLOCK_RE.search(content)
+        if json_match:
+            return json_match.group(1)
+        
+        # Try to find JSON without code blocks
+        return content
+    
+    async def _generate_chunk_notes(self, transcript_text: str, video_info: Dict, options: Dict,
+                                    on_section: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Generate structured notes for one transcript chunk, passing sections to `on_section` as they stream in"""
+        
+        # Streamed notes, which is how the upload page always asks, can't use
+        # JSON mode and rely on the prompt alone; a reply that doesn't parse is
+        # reported as a fallback and never cached, so reprocessing asks again
+        return await self._call_llm(
+            self._notes_messages(transcript_text, video_info),
+            parser=self._parse_structured_notes,
+            fallback=lambda: self._create_fallback_notes(transcript_text, video_info),
+            task="generating structured notes",
+            max_tokens=self._notes_max_tokens(transcript_text),
+            on_delta=self._section_emitter(on_section) if on_section else None,
+            json_mode=on_section is None
+        )
+    
+    def _notes_messages(self, transcript_text: str, video_info: Dict) -> List[Dict]:
+        """Build the chat messages for structured notes"""
+        return self._transcript_messages(transcript_text, video_info, NOTES_USER_PROMPT)
+    
+    def _transcript_messages(self, transcript_text: str, video_info: Dict, instruction: str) -> List[Dict]:
+        """Build chat messages asking `instruction` about a transcript
+        
+        Only the last message differs between kinds of response, so requests
+        about the same transcript share everything before it.
         """
         
+        transcript_prompt = NOTES_VIDEO_TEMPLATE.format(
+            title=video_info.get('title', 'Unknown'),
+            duration=video_info.get('duration', 'Unknown'),
+            platform=video_info.get('platform', 'Unknown'),
+            transcript=transcript_text
+        )
+        
+        return [
+            {"role": "system", "content": NOTES_SYSTEM_PROMPT},
+            {"role": "user", "content": transcript_prompt},
+            {"role": "user", "content": instruction}
+        ]
+    
+    def _parse_structured_notes(self, content: str) -> Dict:
+        """Parse a structured notes reply, raising ParseFallback if it is not JSON"""
+        
+        # Parse the JSON response (handle markdown code blocks)
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.4,
-                max_tokens=1200
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Try to parse as JSON
-            try:
-                qa_pairs = json.loads(content)
-                return qa_pairs if isinstance(qa_pairs, list) else []
-            except json.JSONDecodeError:
-                return []
-                
-        except Exception as e:
-            print(f"Error generating Q&A pairs: {e}")
-            return []
+            return json.loads(self._extract_json_text(content))
+        except json.JSONDecodeError as e:
+            # Keep the reply text as a single section
+            raise ParseFallback(self._parse_notes_fallback(content), f"notes reply is not JSON: {e}") from e
+    
+    def _section_emitter(self, on_section: Callable[[Dict], None]) -> Callable[[str], None]:
+        """Build a text delta handler that reports each section once it is complete"""
+        
+        parser = SectionStreamParser()
+        
+        def on_delta(delta):
+            for section in parser.feed(delta):
+                on_section(section)
+        
+        return on_delta
+    
+    async def _generate_summary(self, transcript_text: str, video_info: Dict) -> str:
+        """Generate a concise summary"""
+        
+        return await self._call_llm(
+            self._transcript_messages(transcript_text, video_info, SUMMARY_PROMPT),
+            parser=str.strip,
+            fallback=lambda: "Summary generation failed. Please review the full transcript.",
+            task="generating summary",
+            max_tokens=500
+        )
+    
+    async def _extract_key_takeaways(self, transcript_text: str, video_info: Dict) -> List[str]:
+        """Extract key takeaways from the transcript"""
+        
+        return await self._call_llm(
+            self._transcript_messages(transcript_text, video_info, KEY_TAKEAWAYS_PROMPT),
+            parser=self._parse_key_takeaways,
+            fallback=lambda: ["Key takeaways extraction failed"],
+            task="extracting key takeaways",
+            max_tokens=800,
+            json_mode=True
+        )
+    
+    def _parse_key_takeaways(self, content: str) -> List[str]:
+        """Parse a key takeaways reply"""
+        
+        content = content.strip()
+        
+        # Try to parse as JSON
+        try:
+            takeaways = self._unwrap_items(json.loads(content))
+            return takeaways if isinstance(takeaways, list) else []
+        except json.JSONDecodeError:
+            # Extract from text format
+            return self._extract_list_from_text(content)
+    
+    async def _generate_qa_pairs(self, transcript_text: str, video_info: Dict) -> List[Dict]:
+        """Generate Q&A pairs from the transcript"""
+        
+        return await self._call_llm(
+            self._transcript_messages(transcript_text, video_info, QA_PAIRS_PROMPT),
+            parser=self._parse_qa_pairs,
+            fallback=list,
+            task="generating Q&A pairs",
+            temperature=0.4,
+            max_tokens=1200,
+            json_mode=True
+        )
+    
+    def _parse_qa_pairs(self, content: str) -> List[Dict]:
+        """Parse a Q&A pairs reply, raising ParseFallback if it is not JSON"""
+        
+        # Try to parse as JSON
+        try:
+            qa_pairs = self._unwrap_items(json.loads(content.strip()))
+            return qa_pairs if isinstance(qa_pairs, list) else []
+        except json.JSONDecodeError as e:
+            raise ParseFallback([], f"Q&A pairs reply is not JSON: {e}") from e
+    
+    def _unwrap_items(self, parsed: Any) -> Any:
+        """Get the list from an {"items": [...]} reply; bare arrays pass through"""
+        
+        if isinstance(parsed, dict):
+            return parsed.get('items')
+        return parsed
     
     def _parse_notes_fallback(self, content: str) -> Dict:
         """Fallback parser for when JSON parsing fails"""
@@ -286,11 +997,11 @@ class NotesGenerator:
             if len(paragraph.strip()) > 50:  # Skip very short segments
                 
                 # Extract timestamp if present
-                timestamp_match = re.search(r'\[(\d{2}:\d{2})\]', paragraph)
+                timestamp_match = TIMESTAMP_RE.search(paragraph)
                 timestamp = timestamp_match.group(1) if timestamp_match else f"{i*2:02d}:00"
                 
                 # Clean text
-                clean_text = re.sub(r'\[\d{2}:\d{2}\]', '', paragraph).strip()
+                clean_text = TIMESTAMP_RE.sub('', paragraph).strip()
                 
                 segments.append({
                     "title": f"Section {i+1}",
@@ -322,10 +1033,9 @@ class NotesGenerator:
         for line in lines:
             line = line.strip()
             # Match various list formats
-            if re.match(r'^[\-\*\•]\s+', line):
-                items.append(re.sub(r'^[\-\*\•]\s+', '', line))
-            elif re.match(r'^\d+\.\s+', line):
-                items.append(re.sub(r'^\d+\.\s+', '', line))
+            marker = LIST_MARKER_RE.match(line)
+            if marker:
+                items.append(line[marker.end():])
             elif line and not line.startswith('Here') and not line.startswith('The'):
                 items.append(line)
         
@@ -353,11 +1063,11 @@ class NotesGenerator:
         """Enhance notes with additional metadata"""
         
         # Add reading time estimation
-        total_words = sum(len(section.get('content', '').split()) for section in notes.get('sections', []))
+        total_words, long_words = self._count_words(notes)
         reading_time = max(1, total_words // 200)  # 200 words per minute
         
         # Add difficulty level based on content
-        difficulty = self._estimate_difficulty(notes)
+        difficulty = self._estimate_difficulty(total_words, long_words)
         
         # Update metadata
         if 'metadata' not in notes:
@@ -373,21 +1083,27 @@ class NotesGenerator:
         
         return notes
     
-    def _estimate_difficulty(self, notes: Dict) -> str:
-        """Estimate content difficulty"""
+    def _count_words(self, notes: Dict) -> tuple:
+        """Count all words and long words (>7 characters) in the section contents"""
         
-        # Simple heuristic based on vocabulary and concepts
-        total_text = ' '.join([
-            section.get('content', '') for section in notes.get('sections', [])
-        ])
+        # One pass per section, without joining the contents into a single string
+        total_words = 0
+        long_words = 0
+        for section in notes.get('sections', []):
+            words = section.get('content', '').split()
+            total_words += len(words)
+            long_words += sum(1 for word in words if len(word) > 7)
+        
+        return total_words, long_words
+    
+    def _estimate_difficulty(self, total_words: int, long_words: int) -> str:
+        """Estimate content difficulty"""
         
-        words = total_text.split()
-        if not words:
+        # Simple heuristic based on vocabulary
+        if not total_words:
             return 'Unknown'
         
-        # Count long words (>7 characters)
-        long_words = len([word for word in words if len(word) > 7])
-        long_word_ratio = long_words / len(words)
+        long_word_ratio = long_words / total_words
         
         if long_word_ratio > 0.2:
             return 'Advanced'
@@ -399,19 +1115,12 @@ class NotesGenerator:
     def _determine_content_type(self, notes: Dict) -> str:
         """Determine the type of content"""
         
-        topics = notes.get('topics', [])
         main_theme = notes.get('main_theme', '').lower()
         
-        # Simple classification based on keywords
-        if any(keyword in main_theme for keyword in ['tutorial', 'how to', 'guide', 'learn']):
-            return 'Tutorial'
-        elif any(keyword in main_theme for keyword in ['lecture', 'education', 'course']):
-            return 'Educational'
-        elif any(keyword in main_theme for keyword in ['news', 'update', 'report']):
-            return 'News/Information'
-        elif any(keyword in main_theme for keyword in ['interview', 'discussion', 'talk']):
-            return 'Interview/Discussion'
-        elif any(keyword in main_theme for keyword in ['review', 'analysis', 'opinion']):
-            return 'Review/Analysis'
-        else:
-            return 'General Content'
\ No newline at end of file
+        # Simple classification based on keywords, scanning the theme once;
+        # the highest-priority type found wins
+        matched = {int(match.lastgroup[4:]) for match in CONTENT_TYPE_RE.finditer(main_theme)}
+        if matched:
+            return CONTENT_TYPE_KEYWORDS[min(matched)][0]
+        
+        return 'General Content'
\ No newline at end of file
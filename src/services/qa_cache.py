@@ -0,0 +1,96 @@
+import bisect
+import time
+import numpy as np
+from typing import Any, Dict, Hashable, List, Optional
+
+# Rows are allocated in blocks so inserts don't copy the whole matrix
+_GROWTH_ROWS = 64
+
+class QACache:
+    """Semantic cache that reuses answers for near-duplicate questions"""
+    
+    def __init__(self, namespace: Hashable = None, threshold: float = 0.92,
+                 ttl: int = 60 * 60, max_entries: int = 256):
+        self.namespace = namespace
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        
+        # Row i of the buffer is the L2-normalized embedding for results[i];
+        # only the first len(results) rows are in use
+        self._buffer: Optional[np.ndarray] = None
+        self._results: List[Dict] = []
+        self._created_at: List[float] = []
+    
+    def lookup(self, embedding: Any) -> Optional[Dict]:
+        """Return the cached result of the most similar question, if similar enough"""
+        
+        self._evict_expired()
+        
+        if not self._results:
+            return None
+        
+        # Cosine similarity against every cached question in one matrix-vector product
+        similarities = self._buffer[:len(self._results)] @ self._normalize(embedding)
+        best = int(similarities.argmax())
+        
+        if similarities[best] < self.threshold:
+            return None
+        
+        return self._results[best]
+    
+    def add(self, embedding: Any, result: Dict):
+        """Cache a result under its question embedding"""
+        
+        row = self._normalize(embedding)
+        size = len(self._results)
+        
+        if self._buffer is None or self._buffer.shape[1] != row.shape[0]:
+            self._buffer = np.empty((_GROWTH_ROWS, row.shape[0]), dtype=np.float32)
+        elif size == self._buffer.shape[0]:
+            grown = np.empty((size + _GROWTH_ROWS, row.shape[0]), dtype=np.float32)
+            grown[:size] = self._buffer[:size]
+            self._buffer = grown
+        
+        self._buffer[size] = row
+        self._results.append(result)
+        self._created_at.append(time.time())
+        
+        # Drop the oldest entries once the cache is full
+        overflow = len(self._results) - self.max_entries
+        if overflow > 0:
+            self._drop_oldest(overflow)
+    
+    def clear(self):
+        """Remove all cached results"""
+        
+        self._buffer = None
+        self._results = []
+        self._created_at = []
+    
+    def __len__(self) -> int:
+        return len(self._results)
+    
+    def _evict_expired(self):
+        """Drop entries older than the TTL"""
+        
+        # Entries are appended in time order, so expired ones form a prefix
+        expired = bisect.bisect_left(self._created_at, time.time() - self.ttl)
+        if expired:
+            self._drop_oldest(expired)
+    
+    def _drop_oldest(self, count: int):
+        """Drop the first `count` entries"""
+        
+        remaining = len(self._results) - count
+        self._buffer[:remaining] = self._buffer[count:count + remaining]
+        self._results = self._results[count:]
+        self._created_at = self._created_at[count:]
+    
+    @staticmethod
+    def _normalize(embedding: Any) -> np.ndarray:
+        """Convert an embedding to a unit-length float32 vector"""
+        
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -1,53 +1,323 @@
 from groq import Groq
 import numpy as np
-from typing import Dict, List, Optional, Any
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+import hashlib
 import json
 import re
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import chromadb
 from sentence_transformers import SentenceTransformer
 
+EMBEDDING_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+# Dynamically quantized INT8 ONNX export published with the embedding model;
+# it uses VNNI int8 dot products on CPUs that have them
+EMBEDDING_ONNX_FILE = 'onnx/model_qint8_avx512_vnni.onnx'
+
+# Embedding models shared by every RAG system in the process, by model name
+_embedding_models: Dict[str, SentenceTransformer] = {}
+_embedding_models_lock = threading.Lock()
+
+# Recently embedded queries kept per RAG system
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# Words that may surround a concept anchor without changing what is being asked
+CONCEPT_FILLER_WORDS = frozenset({
+    'tell', 'me', 'more', 'about', 'explain', 'in', 'detail', 'detailed',
+    'what', 'is', 'are', 'was', 'were', 'the', 'a', 'an', 'of', 'on',
+    'describe', 'discuss', 'summarize', 'please', 'can', 'you'
+})
+
+# Words used for keyword overlap and concept anchor matching
+WORD_RE = re.compile(r'\b\w+\b')
+
+# Sentence boundaries for splitting chunks
+SENTENCE_END_RE = re.compile(r'[.!?]+')
+
+# A sentence ending in a question mark
+QUESTION_RE = re.compile(r'[^.!?\n]*\?')
+
+# Follow-up questions suggested per answer
+FOLLOW_UP_COUNT = 3
+
+# Heading the model writes between an answer and its follow-up questions,
+# compared after dropping markdown emphasis and case
+FOLLOW_UPS_HEADING = "follow-up questions:"
+HEADING_NOISE_RE = re.compile(r'[#*_\s]+')
+
+# Leading numbering or bullet on a suggested follow-up question
+QUESTION_NUMBER_RE = re.compile(r'^\d+\.\s*')
+QUESTION_BULLET_RE = re.compile(r'^[\-\*]\s*')
+
+# Reranking boost for chunk types that condense the content
+SOURCE_BOOSTS = {'key_point': 1.2, 'quote': 1.1}
+
+# All videos share one persistent collection; chunks are tagged with their
+# video and addressed by content, so re-processed videos aren't re-embedded
+COLLECTION_NAME = "video_content"
+
+# Shown in place of an answer when generation fails
+ANSWER_ERROR_MESSAGE = "I apologize, but I encountered an error while generating the answer. Please try again."
+
+# Chunk types that come from the notes rather than the transcript
+NOTES_CHUNK_TYPES = ['notes_section', 'key_point', 'quote']
+
+# HNSW graph settings for new collections. Small collections are still served
+# exactly, since ef is larger than the number of candidates requested. ef is
+# fixed when the shared collection is created, never per query, since every
+# session searches the same persisted collection.
+HNSW_M = 16
+HNSW_CONSTRUCTION_EF = 200
+DEFAULT_SEARCH_EF = 64
+
+# Cosine distance, so relevance scores (1 - distance) are cosine similarities
+HNSW_SPACE = "cosine"
+
+# Grow the index capacity by 2x when full instead of the default 1.2x, so
+# bulk inserts reallocate the graph less often
+HNSW_RESIZE_FACTOR = 2.0
+
+class FollowUpSplitter:
+    """Separate an answer from the follow-up questions written after it, as the reply streams in"""
+    
+    def __init__(self):
+        self._pending = ""
+        self._in_line = False
+        self._answer_parts = []
+        self._follow_up_parts = None
+    
+    @property
+    def answer(self) -> str:
+        return "".join(self._answer_parts).strip()
+    
+    @property
+    def follow_up_text(self) -> Optional[str]:
+        """Text after the follow-up heading, or None if the reply had none"""
+        return None if self._follow_up_parts is None else "".join(self._follow_up_parts)
+    
+    def feed(self, delta: str) -> str:
+        """Add streamed text and return the answer text that is safe to show"""
+        
+        text = self._pending + delta
+        self._pending = ""
+        shown = []
+        
+        while text:
+            if self._follow_up_parts is not None:
+                self._follow_up_parts.append(text)
+                break
+            
+            newline = text.find("\n")
+            
+            # Inside a line that can't be the heading, pass text through
+            if self._in_line:
+                end = len(text) if newline == -1 else newline + 1
+                shown.append(text[:end])
+                self._in_line = newline == -1
+                text = text[end:]
+                continue
+            
+            line = text if newline == -1 else text[:newline]
+            heading = self._heading_key(line)
+            
+            if newline == -1:
+                # Hold a line back only while it may still become the heading
+                if FOLLOW_UPS_HEADING.startswith(heading):
+                    self._pending = text
+                else:
+                    self._in_line = True
+                    continue
+                break
+            
+            if heading.rstrip(':') == FOLLOW_UPS_HEADING.rstrip(':'):
+                self._follow_up_parts = []
+            else:
+                shown.append(text[:newline + 1])
+            text = text[newline + 1:]
+        
+        shown_text = "".join(shown)
+        self._answer_parts.append(shown_text)
+        return shown_text
+    
+    def finish(self) -> str:
+        """Flush text held back at the end of the reply"""
+        
+        pending = self._pending
+        self._pending = ""
+        
+        if self._heading_key(pending).rstrip(':') == FOLLOW_UPS_HEADING.rstrip(':'):
+            self._follow_up_parts = []
+            return ""
+        
+        self._answer_parts.append(pending)
+        return pending
+    
+    @staticmethod
+    def _heading_key(line: str) -> str:
+        return HEADING_NOISE_RE.sub(' ', line).strip().lower()
+
 class RAGSystem:
     """RAG (Retrieval-Augmented Generation) system for video content Q&A"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, search_ef: int = DEFAULT_SEARCH_EF):
         self.client = Groq(api_key=api_key)
-        self.embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.embedding_model = self._load_embedding_model()
         self.chat_model = "llama-3.3-70b-versatile"
         self.chroma_client = None
-        self.collection = None
+        self.search_ef = search_ef
+        
+        # Collections by name, so one instance can serve several vector stores;
+        # which video a caller works on travels in its vector store dict, since
+        # one instance serves every session
+        self._collections = {}
+        
+        # Cached per instance rather than on the method, so entries go with the instance
+        self._query_embeddings = lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._encode_query)
     
-    def setup_vector_store(self, transcript: Dict, notes: Dict, chunk_size: int = 1000) -> Dict:
-        """Setup vector store with transcript and notes content"""
+    def _load_embedding_model(self) -> SentenceTransformer:
+        """Get the shared embedding model, loading it on first use"""
         
-        # Initialize ChromaDB with new PersistentClient
-        self.chroma_client = chromadb.PersistentClient(
-            path="./data/embeddings"
-        )
+        with _embedding_models_lock:
+            if EMBEDDING_MODEL_NAME not in _embedding_models:
+                _embedding_models[EMBEDDING_MODEL_NAME] = self._build_embedding_model()
+            
+            return _embedding_models[EMBEDDING_MODEL_NAME]
+    
+    def _build_embedding_model(self) -> SentenceTransformer:
+        """Load the embedding model, preferring its quantized ONNX export"""
+        
+        try:
+            return SentenceTransformer(
+                EMBEDDING_MODEL_NAME,
+                backend='onnx',
+                model_kwargs={'file_name': EMBEDDING_ONNX_FILE}
+            )
+        except Exception as e:
+            print(f"ONNX embedding backend unavailable, using PyTorch: {e}")
+            return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    
+    def setup_vector_store(self, transcript: Dict, notes: Dict, chunk_size: int = 1000,
+                           progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict:
+        """Setup vector store with transcript and notes content"""
         
-        # Create or get collection
-        collection_name = f"video_content_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        self.collection = self.chroma_client.create_collection(
+        # Get the shared collection, creating it on first use
+        collection_name = COLLECTION_NAME
+        collection = self._get_chroma_client().get_or_create_collection(
             name=collection_name,
-            metadata={"description": "Video content for RAG"}
+            metadata={"description": "Video content for RAG"},
+            configuration={
+                "hnsw": {
+                    "max_neighbors": HNSW_M,
+                    "ef_construction": HNSW_CONSTRUCTION_EF,
+                    "ef_search": self.search_ef,
+                    "space": HNSW_SPACE,
+                    "resize_factor": HNSW_RESIZE_FACTOR
+                }
+            }
         )
+        self._collections[collection_name] = collection
+        
+        video_id = self._video_id(transcript)
         
         # Process and chunk content
-        chunks = self._create_chunks(transcript, notes, chunk_size)
+        chunks = self._create_chunks(transcript, notes, chunk_size, video_id)
         
         # Generate embeddings and store
-        self._store_chunks(chunks)
+        self._store_chunks(chunks, collection, progress_callback)
         
         return {
             'collection_name': collection_name,
+            'video_id': video_id,
             'total_chunks': len(chunks),
             'chunk_size': chunk_size
         }
     
-    def _create_chunks(self, transcript: Dict, notes: Dict, chunk_size: int) -> List[Dict]:
+    def add_notes_to_vector_store(self, vector_store: Dict, notes: Dict, chunk_size: int = 1000) -> Dict:
+        """Add notes content to an existing vector store"""
+        
+        video_id = vector_store.get('video_id')
+        collection = self._get_collection(vector_store)
+        chunks = self._create_chunks({}, notes, chunk_size, video_id)
+        
+        # Drop notes stored by an earlier run for the same video that these replace
+        if video_id:
+            stored = collection.get(
+                where={'$and': [{'video_id': video_id}, {'type': {'$in': NOTES_CHUNK_TYPES}}]},
+                include=[]
+            )
+            current = {chunk['id'] for chunk in chunks}
+            stale = [chunk_id for chunk_id in stored['ids'] if chunk_id not in current]
+            if stale:
+                collection.delete(ids=stale)
+        
+        self._store_chunks(chunks, collection)
+        
+        return {
+            **vector_store,
+            'total_chunks': vector_store.get('total_chunks', 0) + len(chunks)
+        }
+    
+    def _get_chroma_client(self):
+        """Get the persistent ChromaDB client, creating it on first use"""
+        
+        if self.chroma_client is None:
+            self.chroma_client = chromadb.PersistentClient(
+                path="./data/embeddings"
+            )
+        
+        return self.chroma_client
+    
+    def _get_collection(self, vector_store: Optional[Dict]):
+        """Get the collection described by a vector store, reopening it if needed"""
+        
+        collection_name = (vector_store or {}).get('collection_name') or COLLECTION_NAME
+        if collection_name not in self._collections:
+            self._collections[collection_name] = self._get_chroma_client().get_collection(collection_name)
+        
+        return self._collections[collection_name]
+    
+    def _video_id(self, transcript: Dict) -> str:
+        """Identify a video by the content of its transcript"""
+        
+        content = json.dumps(transcript.get('segments') or transcript.get('full_text', ''), sort_keys=True, default=str)
+        return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+    
+    def _video_filter(self, vector_store: Optional[Dict]) -> Optional[Dict]:
+        """Get the metadata filter that limits a query to one video's chunks"""
+        
+        video_id = (vector_store or {}).get('video_id')
+        return {'video_id': video_id} if video_id else None
+    
+    def _create_chunks(self, transcript: Dict, notes: Dict, chunk_size: int,
+                       video_id: Optional[str] = None) -> List[Dict]:
         """Create semantic chunks from transcript and notes"""
         
-        chunks = []
+        final_chunks = []
+        
+        for chunk in self._iter_source_chunks(transcript, notes):
+            # Split large chunks
+            pieces = self._split_large_chunk(chunk, chunk_size) if len(chunk['content']) > chunk_size else [chunk]
+            
+            # Address chunks by video, position and content, so an unchanged chunk
+            # keeps its id across runs
+            for piece in pieces:
+                key = f"{video_id}\0{piece['id']}\0{piece['content']}"
+                piece['id'] = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+                if video_id:
+                    piece['metadata'] = {**piece['metadata'], 'video_id': video_id}
+                final_chunks.append(piece)
+        
+        return final_chunks
+    
+    def _iter_source_chunks(self, transcript: Dict, notes: Dict) -> Iterator[Dict]:
+        """Yield one chunk per transcript segment, notes section, key point and quote
+        
+        Chunks carry only the flat scalar metadata that is stored with them in
+        ChromaDB and read back when citing sources.
+        """
+        
         chunk_id = 0
         
         # Process transcript segments
@@ -56,36 +326,30 @@ class RAGSystem:
                 chunk = {
                     'id': f"transcript_{chunk_id}",
                     'content': segment.get('text', ''),
-                    'source': 'transcript',
-                    'timestamp': segment.get('start', '00:00'),
-                    'speaker': segment.get('speaker', ''),
                     'metadata': {
                         'type': 'transcript_segment',
-                        'start_time': segment.get('start', '00:00'),
-                        'end_time': segment.get('end', '00:00')
+                        'timestamp': segment.get('start', '00:00')
                     }
                 }
-                chunks.append(chunk)
+                yield chunk
                 chunk_id += 1
         
         # Process notes sections
         if 'sections' in notes:
             for section in notes['sections']:
+                section_metadata = {
+                    'section_title': section.get('title', ''),
+                    'timestamp': section.get('timestamp', '00:00')
+                }
+                
                 # Main section content
                 if section.get('content'):
                     chunk = {
                         'id': f"notes_{chunk_id}",
                         'content': section['content'],
-                        'source': 'notes',
-                        'timestamp': section.get('timestamp', '00:00'),
-                        'section_title': section.get('title', ''),
-                        'metadata': {
-                            'type': 'notes_section',
-                            'section_title': section.get('title', ''),
-                            'timestamp': section.get('timestamp', '00:00')
-                        }
+                        'metadata': {'type': 'notes_section', **section_metadata}
                     }
-                    chunks.append(chunk)
+                    yield chunk
                     chunk_id += 1
                 
                 # Key points as separate chunks
@@ -94,16 +358,9 @@ class RAGSystem:
                         chunk = {
                             'id': f"keypoint_{chunk_id}",
                             'content': point,
-                            'source': 'key_points',
-                            'timestamp': section.get('timestamp', '00:00'),
-                            'section_title': section.get('title', ''),
-                            'metadata': {
-                                'type': 'key_point',
-                                'section_title': section.get('title', ''),
-                                'timestamp': section.get('timestamp', '00:00')
-                            }
+                            'metadata': {'type': 'key_point', **section_metadata}
                         }
-                        chunks.append(chunk)
+                        yield chunk
                         chunk_id += 1
                 
                 # Quotes as separate chunks
@@ -112,143 +369,306 @@ class RAGSystem:
                         chunk = {
                             'id': f"quote_{chunk_id}",
                             'content': quote,
-                            'source': 'quotes',
-                            'timestamp': section.get('timestamp', '00:00'),
-                            'section_title': section.get('title', ''),
-                            'metadata': {
-                                'type': 'quote',
-                                'section_title': section.get('title', ''),
-                                'timestamp': section.get('timestamp', '00:00')
-                            }
+                            'metadata': {'type': 'quote', **section_metadata}
                         }
-                        chunks.append(chunk)
+                        yield chunk
                         chunk_id += 1
-        
-        # Split large chunks
-        final_chunks = []
-        for chunk in chunks:
-            if len(chunk['content']) > chunk_size:
-                split_chunks = self._split_large_chunk(chunk, chunk_size)
-                final_chunks.extend(split_chunks)
-            else:
-                final_chunks.append(chunk)
-        
-        return final_chunks
     
     def _split_large_chunk(self, chunk: Dict, max_size: int) -> List[Dict]:
         """Split large chunks into smaller ones"""
         
-        content = chunk['content']
+        # Fields shared by every piece
+        base = {key: value for key, value in chunk.items() if key not in ('id', 'content')}
         chunks = []
         
-        # Split by sentences first
-        sentences = re.split(r'[.!?]+', content)
+        def add_piece(parts):
+            chunks.append({**base, 'id': f"{chunk['id']}_{len(chunks)}", 'content': ". ".join(parts)})
         
-        current_chunk = ""
-        chunk_count = 0
+        # Split by sentences first, joining them back once per piece
+        current_parts = []
+        current_length = 0
         
-        for sentence in sentences:
+        for sentence in SENTENCE_END_RE.split(chunk['content']):
             sentence = sentence.strip()
             if not sentence:
                 continue
             
             # Check if adding this sentence would exceed max size
-            if len(current_chunk) + len(sentence) > max_size and current_chunk:
-                # Save current chunk
-                new_chunk = chunk.copy()
-                new_chunk['id'] = f"{chunk['id']}_{chunk_count}"
-                new_chunk['content'] = current_chunk.strip()
-                chunks.append(new_chunk)
-                
-                # Start new chunk
-                current_chunk = sentence
-                chunk_count += 1
-            else:
-                current_chunk += ". " + sentence if current_chunk else sentence
+            if current_parts and current_length + len(sentence) > max_size:
+                add_piece(current_parts)
+                current_parts = []
+                current_length = 0
+            
+            current_length += len(sentence) + (2 if current_parts else 0)
+            current_parts.append(sentence)
         
         # Add final chunk
-        if current_chunk:
-            new_chunk = chunk.copy()
-            new_chunk['id'] = f"{chunk['id']}_{chunk_count}"
-            new_chunk['content'] = current_chunk.strip()
-            chunks.append(new_chunk)
+        if current_parts:
+            add_piece(current_parts)
         
         return chunks
     
-    def _store_chunks(self, chunks: List[Dict]):
+    def _store_chunks(self, chunks: List[Dict], collection,
+                      progress_callback: Optional[Callable[[int, int], None]] = None):
         """Store chunks in vector database"""
         
+        if not chunks:
+            return
+        
+        # Chunks already in the collection keep their stored embeddings
+        stored = set(collection.get(ids=[chunk['id'] for chunk in chunks], include=[])['ids'])
+        new_chunks = [chunk for chunk in chunks if chunk['id'] not in stored]
+        
+        if progress_callback and stored:
+            progress_callback(len(stored), len(chunks))
+        
+        if not new_chunks:
+            return
+        
         batch_size = 100
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i+batch_size]
-            
-            # Prepare data for ChromaDB
-            ids = [chunk['id'] for chunk in batch]
-            documents = [chunk['content'] for chunk in batch]
-            metadatas = [chunk['metadata'] for chunk in batch]
-            
-            # Generate embeddings
-            embeddings = self._generate_embeddings([chunk['content'] for chunk in batch])
+        batches = [new_chunks[i:i+batch_size] for i in range(0, len(new_chunks), batch_size)]
+        
+        def embed(batch):
+            return self._generate_embeddings([chunk['content'] for chunk in batch])
+        
+        # The next batch is embedded on a worker while this thread writes the
+        # current one, so the model and ChromaDB work overlap; progress is
+        # still reported from the calling thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(embed, batches[0])
+            done = len(stored)
             
-            # Store in ChromaDB
-            self.collection.add(
-                ids=ids,
-                documents=documents,
-                metadatas=metadatas,
-                embeddings=embeddings
-            )
+            for i, batch in enumerate(batches):
+                embeddings = pending.result()
+                if i + 1 < len(batches):
+                    pending = executor.submit(embed, batches[i + 1])
+                
+                # Store in ChromaDB
+                collection.add(
+                    ids=[chunk['id'] for chunk in batch],
+                    documents=[chunk['content'] for chunk in batch],
+                    metadatas=[chunk['metadata'] for chunk in batch],
+                    embeddings=embeddings
+                )
+                
+                done += len(batch)
+                if progress_callback:
+                    progress_callback(done, len(chunks))
     
-    def _generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
         """Generate embeddings for texts using local sentence-transformers model"""
         
         try:
-            # Generate embeddings using sentence-transformers
-            embeddings = self.embedding_model.encode(texts)
+            # Generate embeddings using sentence-transformers; encode() sorts the
+            # texts by length itself, so each batch pads to similar lengths
+            embeddings = self.embedding_model.encode(
+                texts,
+                batch_size=64,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
             
-            # Convert to list of lists
-            return [embedding.tolist() for embedding in embeddings]
+            # Chroma takes a contiguous float32 matrix as is, without boxing every
+            # value; this only copies if the backend returned something else
+            return np.ascontiguousarray(embeddings, dtype=np.float32)
             
         except Exception as e:
+            # Chunk ids are content-addressed and never re-embedded once stored,
+            # so a failed batch must not be written; raising leaves it for the
+            # next run to retry
             print(f"Error generating embeddings: {e}")
-            # Return dummy embeddings for development (384-dimensional for all-MiniLM-L6-v2)
-            return [[0.0] * 384 for _ in texts]
+            raise
     
-    def answer_question(self, question: str, vector_store: Dict, options: Dict) -> Dict:
-        """Answer a question using RAG"""
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single query with the local sentence-transformers model
         
-        # Retrieve relevant chunks
-        relevant_chunks = self._retrieve_relevant_chunks(
-            question, 
-            options.get('max_sources', 3)
-        )
+        Embeddings of recent queries are cached, so the returned array is
+        read-only.
+        """
+        return self._query_embeddings(text)
+    
+    def _encode_query(self, text: str) -> np.ndarray:
+        """Embed a single query without the cache"""
+        
+        embedding = self.embedding_model.encode([text])[0]
+        embedding.flags.writeable = False
+        return embedding
+    
+    def answer_question(self, question: str, vector_store: Dict, options: Dict,
+                        chunks: Optional[List[Dict]] = None,
+                        stream: bool = False) -> Union[Dict, Iterator[Union[str, Dict]]]:
+        """Answer a question using RAG
         
-        # Generate answer
-        answer = self._generate_answer(question, relevant_chunks, options)
+        With stream=True, retrieval runs immediately and a generator is returned
+        that yields answer text deltas followed by the complete result dict.
+        """
+        
+        max_results = options.get('max_sources', 3)
+        
+        if chunks is None:
+            # Retrieve relevant chunks
+            relevant_chunks = self._retrieve_relevant_chunks(
+                question, max_results, vector_store
+            )
+        else:
+            # Pre-resolved chunks only need reranking against the question
+            relevant_chunks = self._rerank_chunks(question, [dict(chunk) for chunk in chunks], max_results)
+        
+        # Format the context once for the answer and the follow-up questions
+        context_parts = self._context_parts(relevant_chunks)
+        
+        if stream:
+            return self._stream_answer(question, relevant_chunks, context_parts, options)
+        
+        # Generate answer; the follow-up questions come in the same reply
+        splitter = FollowUpSplitter()
+        failed = False
+        try:
+            splitter.feed(self._generate_answer(question, context_parts, options))
+        except Exception as e:
+            print(f"Error generating answer: {e}")
+            failed = True
+            splitter.feed(ANSWER_ERROR_MESSAGE)
+        splitter.finish()
+        
+        return self._build_result(question, splitter, relevant_chunks, context_parts, options, failed)
+    
+    def _stream_answer(self, question: str, chunks: List[Dict], context_parts: List[str],
+                       options: Dict) -> Iterator[Union[str, Dict]]:
+        """Yield answer text as it is generated, then the complete result"""
+        
+        # The follow-up questions at the end of the reply are kept out of the stream
+        splitter = FollowUpSplitter()
+        failed = False
+        try:
+            for delta in self._generate_answer_stream(question, context_parts, options):
+                shown = splitter.feed(delta)
+                if shown:
+                    yield shown
+        except Exception as e:
+            print(f"Error generating answer: {e}")
+            failed = True
+            shown = splitter.feed(ANSWER_ERROR_MESSAGE)
+            if shown:
+                yield shown
+        
+        shown = splitter.finish()
+        if shown:
+            yield shown
+        
+        yield self._build_result(question, splitter, chunks, context_parts, options, failed)
+    
+    def _build_result(self, question: str, reply: FollowUpSplitter, relevant_chunks: List[Dict],
+                      context_parts: List[str], options: Dict, failed: bool = False) -> Dict:
+        """Attach sources, follow-ups and confidence to a generated answer
+        
+        A failed generation is flagged with 'error' so it is never cached.
+        """
+        
+        answer = reply.answer
         
         # Process sources
         sources = self._process_sources(relevant_chunks, options)
         
-        # Generate follow-up questions
-        follow_ups = self._generate_follow_up_questions(question, answer, relevant_chunks)
+        # Use the follow-up questions written with the answer, asking separately
+        # only if the reply had none
+        follow_ups = self._parse_follow_ups(reply.follow_up_text)
+        if not follow_ups and not failed:
+            follow_ups = self._generate_follow_up_questions(question, answer, "\n".join(context_parts[:3]))
         
         return {
             'answer': answer,
             'sources': sources,
             'follow_up_questions': follow_ups,
-            'confidence': self._calculate_confidence(relevant_chunks, answer)
+            'confidence': self._calculate_confidence(relevant_chunks, answer),
+            'error': failed
         }
     
-    def _retrieve_relevant_chunks(self, question: str, max_results: int) -> List[Dict]:
+    def build_concept_index(self, vector_store: Dict, notes: Dict, default_anchors: List[str],
+                            top_k: int = 20) -> Dict[str, List[Dict]]:
+        """Pre-compute retrieval results for section titles, topics and default anchors"""
+        
+        anchors = [section.get('title', '') for section in notes.get('sections', [])]
+        anchors += notes.get('topics', [])
+        anchors += default_anchors
+        
+        # Normalize and deduplicate while keeping the original order
+        anchors = list(dict.fromkeys(
+            key for key in (self._concept_key(anchor) for anchor in anchors) if key
+        ))
+        
+        if not anchors:
+            return {}
+        
+        try:
+            # Embed all anchors at once and run a single batched query
+            results = self._get_collection(vector_store).query(
+                query_embeddings=self._generate_embeddings(anchors),
+                n_results=top_k,
+                where=self._video_filter(vector_store),
+                include=['documents', 'metadatas', 'distances']
+            )
+            
+            concept_index = {}
+            for a, anchor in enumerate(anchors):
+                concept_index[anchor] = [
+                    {
+                        'content': doc,
+                        'metadata': results['metadatas'][a][i],
+                        'distance': results['distances'][a][i],
+                        'relevance_score': 1 - results['distances'][a][i]
+                    }
+                    for i, doc in enumerate(results['documents'][a])
+                ]
+            
+            return concept_index
+            
+        except Exception as e:
+            print(f"Error building concept index: {e}")
+            return {}
+    
+    def match_concept(self, question: str, concept_index: Optional[Dict[str, List[Dict]]]) -> Optional[List[Dict]]:
+        """Return pre-resolved chunks for the longest concept anchor mentioned in the question"""
+        
+        if not concept_index:
+            return None
+        
+        question_key = self._concept_key(question)
+        if question_key in concept_index:
+            return concept_index[question_key]
+        
+        # Accept an anchor only if the rest of the question is filler
+        # ("Tell me more about X", "Explain X in detail", ...)
+        padded_question = f" {question_key} "
+        matches = [anchor for anchor in concept_index if f" {anchor} " in padded_question]
+        
+        for anchor in sorted(matches, key=len, reverse=True):
+            remainder = padded_question.replace(f" {anchor} ", " ", 1).split()
+            if all(word in CONCEPT_FILLER_WORDS for word in remainder):
+                return concept_index[anchor]
+        
+        return None
+    
+    def _concept_key(self, text: str) -> str:
+        """Normalize text to space-separated lowercase words for anchor matching"""
+        return " ".join(WORD_RE.findall(str(text).lower()))
+    
+    def _retrieve_relevant_chunks(self, question: str, max_results: int,
+                                  vector_store: Optional[Dict] = None) -> List[Dict]:
         """Retrieve relevant chunks for the question"""
         
         try:
+            collection = self._get_collection(vector_store)
+            
             # Generate query embedding using local model
-            query_embedding = self._generate_embeddings([question])[0]
+            query_embedding = self.embed_query(question)
             
             # Search in ChromaDB
-            results = self.collection.query(
+            results = collection.query(
                 query_embeddings=[query_embedding],
                 n_results=max_results * 2,  # Get more results for reranking
+                where=self._video_filter(vector_store),
                 include=['documents', 'metadatas', 'distances']
             )
             
@@ -264,46 +684,88 @@ class RAGSystem:
                 chunks.append(chunk)
             
             # Rerank based on relevance
-            reranked_chunks = self._rerank_chunks(question, chunks)
-            
-            return reranked_chunks[:max_results]
+            return self._rerank_chunks(question, chunks, max_results)
             
         except Exception as e:
             print(f"Error retrieving chunks: {e}")
             return []
     
-    def _rerank_chunks(self, question: str, chunks: List[Dict]) -> List[Dict]:
-        """Rerank chunks based on relevance to question"""
+    def _rerank_chunks(self, question: str, chunks: List[Dict], top_k: Optional[int] = None) -> List[Dict]:
+        """Rerank chunks based on relevance to question, keeping the best `top_k`"""
         
-        # Simple reranking based on keyword matching and semantic similarity
-        question_lower = question.lower()
-        question_keywords = set(re.findall(r'\b\w+\b', question_lower))
+        if not chunks:
+            return []
         
-        for chunk in chunks:
-            content_lower = chunk['content'].lower()
-            content_keywords = set(re.findall(r'\b\w+\b', content_lower))
-            
-            # Keyword overlap score
-            keyword_overlap = len(question_keywords & content_keywords) / len(question_keywords) if question_keywords else 0
-            
-            # Boost score based on source type
-            source_boost = 1.0
-            if chunk['metadata'].get('type') == 'key_point':
-                source_boost = 1.2
-            elif chunk['metadata'].get('type') == 'quote':
-                source_boost = 1.1
-            
-            # Combined relevance score
-            chunk['relevance_score'] = (chunk['relevance_score'] * 0.7 + keyword_overlap * 0.3) * source_boost
+        # Simple reranking based on keyword matching and semantic similarity,
+        # scored for all chunks at once
+        question_keywords = set(WORD_RE.findall(question.lower()))
+        count = len(chunks)
+        
+        similarities = np.fromiter((chunk['relevance_score'] for chunk in chunks), dtype=np.float64, count=count)
+        
+        # Keyword overlap score
+        if question_keywords:
+            overlaps = np.fromiter(
+                (len(question_keywords.intersection(WORD_RE.findall(chunk['content'].lower())))
+                 for chunk in chunks),
+                dtype=np.float64, count=count
+            ) / len(question_keywords)
+        else:
+            overlaps = np.zeros(count)
+        
+        # Boost score based on source type
+        boosts = np.fromiter(
+            (SOURCE_BOOSTS.get(chunk['metadata'].get('type'), 1.0) for chunk in chunks),
+            dtype=np.float64, count=count
+        )
+        
+        # Combined relevance score
+        scores = (similarities * 0.7 + overlaps * 0.3) * boosts
+        for chunk, score in zip(chunks, scores.tolist()):
+            chunk['relevance_score'] = score
+        
+        # Sort by relevance score, partitioning off the top k first
+        if top_k is not None and top_k < count:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            order = top[np.argsort(-scores[top], kind='stable')]
+        else:
+            order = np.argsort(-scores, kind='stable')
+        
+        return [chunks[i] for i in order]
+    
+    def _generate_answer(self, question: str, context_parts: List[str], options: Dict) -> str:
+        """Generate answer using retrieved chunks; errors propagate to the caller"""
+        
+        response = self.client.chat.completions.create(
+            model=self.chat_model,
+            messages=self._answer_messages(question, context_parts),
+            temperature=0.3,
+            max_tokens=1000
+        )
+        
+        return response.choices[0].message.content.strip()
+    
+    def _generate_answer_stream(self, question: str, context_parts: List[str], options: Dict) -> Iterator[str]:
+        """Generate answer using retrieved chunks, yielding text as it arrives; errors propagate"""
+        
+        response = self.client.chat.completions.create(
+            model=self.chat_model,
+            messages=self._answer_messages(question, context_parts),
+            temperature=0.3,
+            max_tokens=1000,
+            stream=True
+        )
         
-        # Sort by relevance score
-        return sorted(chunks, key=lambda x: x['relevance_score'], reverse=True)
+        for chunk in response:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
     
-    def _generate_answer(self, question: str, chunks: List[Dict], options: Dict) -> str:
-        """Generate answer using retrieved chunks"""
+    def _answer_messages(self, question: str, context_parts: List[str]) -> List[Dict]:
+        """Build the chat messages for answering a question from formatted context"""
         
         # Prepare context
-        context = self._prepare_context(chunks)
+        context = "\n".join(context_parts)
         
         # Create system prompt
         system_prompt = """
@@ -327,27 +789,18 @@ class RAGSystem:
         {context}
         
         Please provide a comprehensive answer based on the available information.
+        
+        After the answer, write a line reading "Follow-up questions:" followed by {FOLLOW_UP_COUNT}
+        short follow-up questions the user could ask next, one per line.
         """
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.chat_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3,
-                max_tokens=1000
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            print(f"Error generating answer: {e}")
-            return "I apologize, but I encountered an error while generating the answer. Please try again."
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
     
-    def _prepare_context(self, chunks: List[Dict]) -> str:
-        """Prepare context string from chunks"""
+    def _context_parts(self, chunks: List[Dict]) -> List[str]:
+        """Format each chunk as a numbered context entry"""
         
         context_parts = []
         
@@ -364,7 +817,7 @@ class RAGSystem:
             
             context_parts.append(f"{source_info}:\n{content}\n")
         
-        return "\n".join(context_parts)
+        return context_parts
     
     def _process_sources(self, chunks: List[Dict], options: Dict) -> List[Dict]:
         """Process chunks into source information"""
@@ -383,20 +836,39 @@ class RAGSystem:
         
         return sources
     
-    def _generate_follow_up_questions(self, question: str, answer: str, chunks: List[Dict]) -> List[str]:
-        """Generate follow-up questions based on the answer"""
+    def _parse_follow_ups(self, text: Optional[str]) -> List[str]:
+        """Parse the follow-up questions written after an answer, one per line"""
+        
+        if not text:
+            return []
+        
+        follow_ups = []
+        for line in text.splitlines():
+            line = QUESTION_BULLET_RE.sub('', QUESTION_NUMBER_RE.sub('', line.strip())).strip()
+            if line:
+                follow_ups.append(line)
+        
+        return follow_ups[:FOLLOW_UP_COUNT]
+    
+    def _generate_follow_up_questions(self, question: str, answer: str, context: str) -> List[str]:
+        """Generate follow-up questions based on the answer and its formatted context"""
         
-        context = self._prepare_context(chunks[:3])  # Use top 3 chunks
+        # Questions the answer already suggests are used first; only the
+        # remainder is requested from the model
+        follow_ups = self._extract_questions_from_text(answer)
+        missing = FOLLOW_UP_COUNT - len(follow_ups)
+        if missing <= 0:
+            return follow_ups
         
         prompt = f"""
-        Based on the following question, answer, and context, suggest 3 relevant follow-up questions:
+        Based on the following question, answer, and context, suggest {missing} relevant follow-up questions:
         
         Original Question: {question}
         Answer: {answer}
         Context: {context}
         
-        Please provide 3 follow-up questions that would help the user explore the topic further.
-        Format as a JSON array of strings.
+        Please provide {missing} follow-up questions that would help the user explore the topic further.
+        Format as a JSON object with a "questions" array of strings.
         """
         
         try:
@@ -404,41 +876,44 @@ class RAGSystem:
                 model=self.chat_model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.4,
-                max_tokens=300
+                max_tokens=300,
+                response_format={"type": "json_object"}
             )
             
             content = response.choices[0].message.content.strip()
             
             # Try to parse as JSON
             try:
-                follow_ups = json.loads(content)
-                return follow_ups if isinstance(follow_ups, list) else []
+                suggested = json.loads(content)
+                if isinstance(suggested, dict):
+                    suggested = suggested.get('questions')
+                if not isinstance(suggested, list):
+                    suggested = []
             except json.JSONDecodeError:
                 # Extract questions from text
-                return self._extract_questions_from_text(content)
+                suggested = self._extract_questions_from_text(content)
+            
+            return (follow_ups + suggested)[:FOLLOW_UP_COUNT]
                 
         except Exception as e:
             print(f"Error generating follow-up questions: {e}")
-            return []
+            return follow_ups
     
     def _extract_questions_from_text(self, text: str) -> List[str]:
         """Extract questions from text format"""
         
-        # Look for question marks
-        sentences = re.split(r'[.!?]+', text)
+        # Look for sentences ending in a question mark
         questions = []
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if sentence.endswith('?') or '?' in sentence:
-                # Clean up the question
-                question = sentence.split('?')[0] + '?'
-                question = re.sub(r'^\d+\.\s*', '', question)  # Remove numbering
-                question = re.sub(r'^[\-\*]\s*', '', question)  # Remove bullet points
-                if len(question) > 10:  # Ensure it's a meaningful question
-                    questions.append(question)
+        for match in QUESTION_RE.finditer(text):
+            # Clean up the question
+            question = match.group().strip()
+            question = QUESTION_NUMBER_RE.sub('', question)  # Remove numbering
+            question = QUESTION_BULLET_RE.sub('', question)  # Remove bullet points
+            if len(question) > 10:  # Ensure it's a meaningful question
+                questions.append(question)
         
-        return questions[:3]  # Return max 3 questions
+        return questions[:FOLLOW_UP_COUNT]  # Return max 3 questions
     
     def _calculate_confidence(self, chunks: List[Dict], answer: str) -> float:
         """Calculate confidence score for the answer"""
@@ -461,28 +936,35 @@ class RAGSystem:
         
         return min(confidence, 1.0)
     
-    def get_collection_stats(self) -> Dict:
-        """Get statistics about the current collection"""
-        
-        if not self.collection:
-            return {}
+    def get_collection_stats(self, vector_store: Optional[Dict] = None) -> Dict:
+        """Get statistics about a vector store's video, or the whole collection without one"""
         
         try:
-            count = self.collection.count()
+            collection = self._get_collection(vector_store)
+            video_filter = self._video_filter(vector_store)
+            if video_filter:
+                count = len(collection.get(where=video_filter, include=[])['ids'])
+            else:
+                count = collection.count()
+            query_cache = self._query_embeddings.cache_info()
             return {
                 'total_chunks': count,
-                'collection_name': self.collection.name,
-                'embedding_model': 'sentence-transformers/all-MiniLM-L6-v2'
+                'collection_name': collection.name,
+                'embedding_model': EMBEDDING_MODEL_NAME,
+                'query_cache_hits': query_cache.hits,
+                'query_cache_misses': query_cache.misses
             }
         except:
             return {}
     
-    def clear_collection(self):
-        """Clear the current collection"""
+    def clear_collection(self, vector_store: Dict):
+        """Clear a vector store's video from the collection; other videos are kept"""
         
-        if self.collection:
-            try:
-                self.chroma_client.delete_collection(self.collection.name)
-                self.collection = None
-            except:
-                pass
\ No newline at end of file
+        video_filter = self._video_filter(vector_store)
+        if not video_filter:
+            return
+        
+        try:
+            self._get_collection(vector_store).delete(where=video_filter)
+        except:
+            pass
\ No newline at end of file
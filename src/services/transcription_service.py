@@ -1,9 +1,15 @@
+import re
 import requests
 import time
 from typing import Dict, List, Optional
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.formatters import TextFormatter
 
+# 11-character video ID in youtu.be, watch, embed, /v/, shorts and live URLs
+YOUTUBE_ID_RE = re.compile(
+    r'(?:youtu\.be/|youtube\.com/(?:watch\?(?:[^#]*&)?v=|embed/|v/|shorts/|live/))([A-Za-z0-9_-]{11})'
+)
+
 class TranscriptionService:
     """Handle video transcription using YouTube Transcript API"""
     
@@ -40,17 +46,8 @@ class TranscriptionService:
     
     def _extract_youtube_id(self, url: str) -> Optional[str]:
         """Extract YouTube video ID from URL"""
-        try:
-            if 'youtu.be' in url:
-                return url.split('youtu.be/')[-1].split('?')[0]
-            elif 'youtube.com' in url:
-                if 'watch?v=' in url:
-                    return url.split('watch?v=')[-1].split('&')[0]
-                elif 'embed/' in url:
-                    return url.split('embed/')[-1].split('?')[0]
-            return None
-        except:
-            return None
+        match = YOUTUBE_ID_RE.search(url)
+        return match.group(1) if match else None
     
     def _process_youtube_transcript(self, transcript: List, max_duration: int) -> Dict:
         """Process YouTube transcript data"""
@@ -67,42 +64,48 @@ class TranscriptionService:
         # Format transcript
         full_text = ' '.join([entry['text'] for entry in filtered_transcript])
         
-        # Create timestamped segments
+        # Create timestamped segments, counting words as entries are added
         segments = []
-        current_segment = {'start': 0, 'end': 0, 'text': ''}
+        segment_start = 0
+        segment_end = 0
+        segment_parts = []
+        segment_words = 0
+        total_words = 0
         
         for entry in filtered_transcript:
-            if not current_segment['text']:
-                current_segment['start'] = entry['start']
+            if not segment_parts:
+                segment_start = entry['start']
             
-            current_segment['text'] += ' ' + entry['text']
-            current_segment['end'] = entry['start'] + entry['duration']
+            entry_words = len(entry['text'].split())
+            segment_parts.append(entry['text'])
+            segment_words += entry_words
+            total_words += entry_words
+            segment_end = entry['start'] + entry['duration']
             
             # Create new segment every ~30 seconds or ~200 words
-            if (current_segment['end'] - current_segment['start'] > 30 or 
-                len(current_segment['text'].split()) > 200):
-                
+            if segment_end - segment_start > 30 or segment_words > 200:
                 segments.append({
-                    'start': self._format_timestamp(current_segment['start']),
-                    'end': self._format_timestamp(current_segment['end']),
-                    'text': current_segment['text'].strip()
+                    'start': self._format_timestamp(segment_start),
+                    'end': self._format_timestamp(segment_end),
+                    'text': ' '.join(segment_parts).strip()
                 })
                 
-                current_segment = {'start': entry['start'], 'end': 0, 'text': ''}
+                segment_parts = []
+                segment_words = 0
         
         # Add final segment
-        if current_segment['text']:
+        if segment_parts:
             segments.append({
-                'start': self._format_timestamp(current_segment['start']),
-                'end': self._format_timestamp(current_segment['end']),
-                'text': current_segment['text'].strip()
+                'start': self._format_timestamp(segment_start),
+                'end': self._format_timestamp(segment_end),
+                'text': ' '.join(segment_parts).strip()
             })
         
         return {
             'full_text': full_text,
             'segments': segments,
             'duration': self._format_timestamp(max_seconds if filtered_transcript else 0),
-            'word_count': len(full_text.split()),
+            'word_count': total_words,
             'source': 'YouTube Transcript API'
         }
     
@@ -1,13 +1,50 @@
+import json
 import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
 import requests
-from urllib.parse import urlparse, parse_qs
-from typing import Dict, Optional
-import json
+from urllib3.util.retry import Retry
+from services.transcription_service import YOUTUBE_ID_RE
+from utils.cache import CacheManager
+
+# Metadata lookups are network-bound, so a batch runs many at once while each
+# oEmbed provider sees a bounded number of concurrent requests
+MAX_CONCURRENT_LOOKUPS = 16
+MAX_REQUESTS_PER_PROVIDER = 8
+
+# Transient gateway errors from oEmbed providers are retried on the same
+# pooled connection
+OEMBED_RETRY = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504))
+
+# How long an oEmbed response and its validators are kept for revalidation
+OEMBED_CACHE_TTL = 30 * 24 * 60 * 60
+
+# Verdicts for recently seen URLs, so retyped URLs skip parsing and lookups
+URL_VERDICT_CACHE_SIZE = 4096
+VIDEO_INFO_CACHE_SIZE = 1024
+VIDEO_INFO_TTL = 60 * 60
+
+# Processing time estimates by video length: up to each threshold (minutes)
+# and beyond the last
+PROCESSING_TIME_THRESHOLDS = (5, 15, 30)
+PROCESSING_TIME_LABELS = ("1-2 minutes", "2-4 minutes", "4-8 minutes", "8-15 minutes")
+
+# Supported platform domains, matched against the whole host or one of its
+# subdomains; the matched domain keys VideoProcessor.supported_platforms
+PLATFORM_HOST_RE = re.compile(
+    r'(?:^|\.)(youtube\.com|youtu\.be|vimeo\.com|dailymotion\.com|twitch\.tv)$'
+)
 
 class VideoProcessor:
     """Handle video URL processing and metadata extraction"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[CacheManager] = None):
         self.supported_platforms = {
             'youtube.com': self._process_youtube,
             'youtu.be': self._process_youtube,
@@ -15,28 +52,111 @@ class VideoProcessor:
             'dailymotion.com': self._process_dailymotion,
             'twitch.tv': self._process_twitch
         }
+        
+        # Keep-alive connections are pooled across lookups, with room in each
+        # host's pool for every request a provider allows in flight
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=MAX_REQUESTS_PER_PROVIDER,
+            max_retries=OEMBED_RETRY
+        )
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._provider_limits = {
+            'youtube': threading.Semaphore(MAX_REQUESTS_PER_PROVIDER),
+            'vimeo': threading.Semaphore(MAX_REQUESTS_PER_PROVIDER)
+        }
+        
+        # oEmbed responses are kept with their ETag / Last-Modified so
+        # repeat lookups can be answered with a 304
+        self.cache = cache
+        
+        # Recent results by URL; video info as (expires_at, info)
+        self._url_verdicts = lru_cache(maxsize=URL_VERDICT_CACHE_SIZE)(self._check_url)
+        self._video_infos = OrderedDict()
+        self._video_infos_lock = threading.Lock()
+    
+    def extract_video_info_many(self, video_urls: List[str]) -> List[Dict]:
+        """Extract video information for several URLs concurrently, in input order"""
+        if not video_urls:
+            return []
+        
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_LOOKUPS, len(video_urls))) as executor:
+            return list(executor.map(self.extract_video_info, video_urls))
+    
+    def _get(self, provider: str, url: str, headers: Optional[Dict] = None) -> requests.Response:
+        """GET a provider URL on the shared session, within the provider's concurrency limit"""
+        with self._provider_limits[provider]:
+            return self._session.get(url, headers=headers, timeout=10)
+    
+    def _fetch_oembed(self, provider: str, oembed_url: str) -> Optional[Dict]:
+        """Fetch an oEmbed response, revalidating a cached copy instead of downloading it again"""
+        cache_key = f"oembed_{oembed_url}"
+        cached = self.cache.get(cache_key) if self.cache is not None else None
+        
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        
+        response = self._get(provider, oembed_url, headers)
+        
+        if response.status_code == 304 and cached:
+            return cached['data']
+        
+        if response.status_code != 200:
+            return None
+        
+        data = response.json()
+        
+        # Only responses with a validator can be revalidated later
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if self.cache is not None and (etag or last_modified):
+            self.cache.set(cache_key, {
+                'data': data,
+                'etag': etag,
+                'last_modified': last_modified
+            }, ttl=OEMBED_CACHE_TTL)
+        
+        return data
     
     def extract_video_info(self, video_url: str) -> Dict:
-        """Extract video information from URL"""
+        """Extract video information from URL
+        
+        Results, including failures, are reused for an hour per URL.
+        """
+        with self._video_infos_lock:
+            entry = self._video_infos.get(video_url)
+            if entry is not None:
+                expires_at, info = entry
+                if time.time() < expires_at:
+                    self._video_infos.move_to_end(video_url)
+                    return dict(info)
+                del self._video_infos[video_url]
+        
+        info = self._lookup_video_info(video_url)
+        
+        with self._video_infos_lock:
+            self._video_infos[video_url] = (time.time() + VIDEO_INFO_TTL, info)
+            while len(self._video_infos) > VIDEO_INFO_CACHE_SIZE:
+                self._video_infos.popitem(last=False)
+        
+        return dict(info)
+    
+    def _lookup_video_info(self, video_url: str) -> Dict:
+        """Extract video information from URL without the result cache"""
         try:
             parsed_url = urlparse(video_url)
-            domain = parsed_url.netloc.lower()
-            
-            # Remove 'www.' prefix if present
-            if domain.startswith('www.'):
-                domain = domain[4:]
             
             # Find matching processor
-            processor = None
-            for platform, func in self.supported_platforms.items():
-                if platform in domain:
-                    processor = func
-                    break
-            
-            if not processor:
-                raise ValueError(f"Unsupported platform: {domain}")
+            domain = self._platform_domain(parsed_url)
+            if not domain:
+                raise ValueError(f"Unsupported platform: {parsed_url.netloc.lower()}")
             
-            return processor(video_url, parsed_url)
+            return self.supported_platforms[domain](video_url, parsed_url)
             
         except Exception as e:
             return {
@@ -48,18 +168,16 @@ class VideoProcessor:
                 'error': str(e)
             }
     
+    def _platform_domain(self, parsed_url) -> Optional[str]:
+        """Get the supported platform domain a parsed URL belongs to, if any"""
+        match = PLATFORM_HOST_RE.search(parsed_url.hostname or '')
+        return match.group(1) if match else None
+    
     def _process_youtube(self, video_url: str, parsed_url) -> Dict:
         """Process YouTube video URL"""
-        # Extract video ID
-        video_id = None
-        
-        if 'youtu.be' in parsed_url.netloc:
-            video_id = parsed_url.path[1:]
-        elif 'youtube.com' in parsed_url.netloc:
-            if 'watch' in parsed_url.path:
-                video_id = parse_qs(parsed_url.query).get('v', [None])[0]
-            elif 'embed' in parsed_url.path:
-                video_id = parsed_url.path.split('/')[-1]
+        # Extract video ID, matching the URL forms transcription accepts
+        match = YOUTUBE_ID_RE.search(video_url)
+        video_id = match.group(1) if match else None
         
         if not video_id:
             raise ValueError("Could not extract YouTube video ID")
@@ -96,10 +214,9 @@ class VideoProcessor:
         # Try to extract from YouTube oEmbed API
         try:
             oembed_url = f'https://www.youtube.com/oembed?url=https://www.youtube.com/watch?v={video_id}&format=json'
-            response = requests.get(oembed_url, timeout=10)
+            data = self._fetch_oembed('youtube', oembed_url)
             
-            if response.status_code == 200:
-                data = response.json()
+            if data is not None:
                 return {
                     'title': data.get('title', ''),
                     'duration': 'Unknown',  # oEmbed doesn't provide duration
@@ -122,10 +239,9 @@ class VideoProcessor:
         try:
             # Use Vimeo oEmbed API
             oembed_url = f'https://vimeo.com/api/oembed.json?url={video_url}'
-            response = requests.get(oembed_url, timeout=10)
+            data = self._fetch_oembed('vimeo', oembed_url)
             
-            if response.status_code == 200:
-                data = response.json()
+            if data is not None:
                 return {
                     'title': data.get('title', f'Vimeo Video {video_id}'),
                     'duration': str(data.get('duration', 'Unknown')),
@@ -174,16 +290,16 @@ class VideoProcessor:
     
     def validate_url(self, url: str) -> bool:
         """Validate if URL is supported"""
+        return self._url_verdicts(url)
+    
+    def _check_url(self, url: str) -> bool:
+        """Validate a URL without the verdict cache"""
         try:
             parsed_url = urlparse(url)
             if not all([parsed_url.scheme, parsed_url.netloc]):
                 return False
             
-            domain = parsed_url.netloc.lower()
-            if domain.startswith('www.'):
-                domain = domain[4:]
-            
-            return any(platform in domain for platform in self.supported_platforms.keys())
+            return self._platform_domain(parsed_url) is not None
             
         except:
             return False
@@ -225,14 +341,7 @@ class VideoProcessor:
             else:
                 minutes = int(duration)
             
-            if minutes <= 5:
-                return "1-2 minutes"
-            elif minutes <= 15:
-                return "2-4 minutes"
-            elif minutes <= 30:
-                return "4-8 minutes"
-            else:
-                return "8-15 minutes"
+            return PROCESSING_TIME_LABELS[bisect_left(PROCESSING_TIME_THRESHOLDS, minutes)]
                 
         except:
             return "2-5 minutes"
\ No newline at end of file
@@ -1,59 +1,215 @@
 import os
 import json
+import asyncio
+import functools
 import hashlib
+import heapq
+import io
+import math
+import threading
+import time
+from collections import OrderedDict
 from typing import Any, Optional, Dict
-from datetime import datetime, timedelta
 import pickle
+import struct
+import zlib
+import numpy as np
+
+# Each entry is one .bin file: a fixed header of magic, created_at and ttl
+# (seconds), then the payload
+ENTRY_HEADER = struct.Struct('<4sdd')
+ENTRY_MAGIC = b'VAC1'
+
+# Payload formats, marked by the first byte of the payload
+PAYLOAD_TEXT = b'T'
+PAYLOAD_ARRAY = b'A'
+PAYLOAD_PICKLE = b'P'
+PAYLOAD_COMPRESSED = b'Z'
+
+# Payloads from this size are stored zlib-compressed if that makes them smaller;
+# level 1 shrinks text several times at little CPU cost
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 1
+
+# Data and metadata files of entries from earlier cache layouts
+LEGACY_SUFFIXES = ('.cache', '.meta')
+
+def _digest(text: str) -> str:
+    """Hash text for a cache key"""
+    # Keys need no collision resistance; BLAKE2b is faster than MD5 and
+    # gives the same 32 hex digits
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def _encode_payload(value: Any) -> bytes:
+    """Serialize a cached value, storing text and arrays without pickle"""
+    if isinstance(value, str):
+        data = PAYLOAD_TEXT + value.encode()
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        buffer = io.BytesIO()
+        buffer.write(PAYLOAD_ARRAY)
+        np.save(buffer, value, allow_pickle=False)
+        data = buffer.getvalue()
+    else:
+        data = PAYLOAD_PICKLE + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    if len(data) >= COMPRESS_MIN_BYTES:
+        compressed = PAYLOAD_COMPRESSED + zlib.compress(data, COMPRESS_LEVEL)
+        if len(compressed) < len(data):
+            return compressed
+    
+    return data
+
+def _decode_payload(data: bytes) -> Any:
+    """Deserialize a value written by _encode_payload"""
+    marker, payload = bytes(data[:1]), memoryview(data)[1:]
+    
+    if marker == PAYLOAD_TEXT:
+        return str(payload, 'utf-8')
+    if marker == PAYLOAD_ARRAY:
+        return np.load(io.BytesIO(payload), allow_pickle=False)
+    if marker == PAYLOAD_PICKLE:
+        return pickle.loads(payload)
+    if marker == PAYLOAD_COMPRESSED:
+        return _decode_payload(zlib.decompress(payload))
+    raise ValueError(f"Unknown cache payload format: {marker!r}")
 
 class CacheManager:
-    """Simple file-based cache for video processing results"""
+    """Simple file-based cache for video processing results
     
-    def __init__(self, cache_dir: str = "./data/cache"):
+    Entries are sharded into subdirectories by the first two hex digits of
+    their hashed key. An in-memory index of stored entries, built by one scan
+    on first use, serves eviction and stats without listing the directory.
+    Nothing touches the disk until the cache is first used, and a disabled
+    cache never does.
+    """
+    
+    def __init__(self, cache_dir: str = "./data/cache", enabled: bool = True):
         self.cache_dir = cache_dir
-        os.makedirs(cache_dir, exist_ok=True)
+        self.enabled = enabled
         
         # Cache settings
         self.default_ttl = 7 * 24 * 60 * 60  # 7 days in seconds
         self.max_cache_size = 1000  # Maximum number of cached items
+        
+        # Recently used entries are also kept in memory, by hashed key, as
+        # (expires_at, value); Streamlit serves sessions from several threads
+        self.max_memory_items = 256
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+        
+        # Stored entries by hashed key, as (created_at, ttl, size), and a
+        # min-heap of (created_at, cache_key) for evicting the oldest; heap
+        # items for entries since deleted or rewritten are skipped when popped
+        self._index = None
+        self._eviction_heap = []
+        self._shards = set()
     
     def _get_cache_key(self, key: str) -> str:
         """Generate cache key hash"""
-        return hashlib.md5(key.encode()).hexdigest()
+        return _digest(key)
+    
+    def _get_shard_dir(self, cache_key: str) -> str:
+        """Get the subdirectory holding a cache entry"""
+        return os.path.join(self.cache_dir, cache_key[:2])
     
     def _get_cache_path(self, cache_key: str) -> str:
         """Get cache file path"""
-        return os.path.join(self.cache_dir, f"{cache_key}.cache")
+        return os.path.join(self._get_shard_dir(cache_key), f"{cache_key}.bin")
+    
+    def _entries(self) -> Dict:
+        """Get the index of stored entries, scanning the cache directory on first use
+        
+        Must be called with the lock held.
+        """
+        if self._index is not None:
+            return self._index
+        
+        index = {}
+        if not os.path.isdir(self.cache_dir):
+            self._index = index
+            self._rebuild_eviction_heap()
+            return index
+        
+        with os.scandir(self.cache_dir) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    # Entries from before sharding can no longer be found
+                    if shard.name.endswith(LEGACY_SUFFIXES):
+                        os.remove(shard.path)
+                    continue
+                
+                self._shards.add(shard.name)
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        if entry.name.endswith('.bin'):
+                            with open(entry.path, 'rb') as f:
+                                header = f.read(ENTRY_HEADER.size)
+                            
+                            # Drop files cut short by an interrupted write
+                            if len(header) < ENTRY_HEADER.size or header[:4] != ENTRY_MAGIC:
+                                os.remove(entry.path)
+                                continue
+                            
+                            _, created_at, ttl = ENTRY_HEADER.unpack(header)
+                            size = entry.stat().st_size - ENTRY_HEADER.size
+                            index[entry.name[:-len('.bin')]] = (created_at, ttl, size)
+                        
+                        elif entry.name.endswith(LEGACY_SUFFIXES):
+                            # Entries from before single-file storage are not read
+                            os.remove(entry.path)
+        
+        self._index = index
+        self._rebuild_eviction_heap()
+        return index
     
-    def _get_metadata_path(self, cache_key: str) -> str:
-        """Get metadata file path"""
-        return os.path.join(self.cache_dir, f"{cache_key}.meta")
+    def _rebuild_eviction_heap(self):
+        """Rebuild the eviction heap from the index, dropping stale items"""
+        self._eviction_heap = [(created_at, cache_key) for cache_key, (created_at, _, _) in self._index.items()]
+        heapq.heapify(self._eviction_heap)
     
     def get(self, key: str) -> Optional[Any]:
         """Get item from cache"""
+        if not self.enabled:
+            return None
+        
         try:
             cache_key = self._get_cache_key(key)
-            cache_path = self._get_cache_path(cache_key)
-            meta_path = self._get_metadata_path(cache_key)
             
-            # Check if cache files exist
-            if not os.path.exists(cache_path) or not os.path.exists(meta_path):
-                return None
+            with self._lock:
+                # Serve hot entries from memory
+                entry = self._memory.get(cache_key)
+                if entry is not None:
+                    expires_at, value = entry
+                    if time.time() < expires_at:
+                        self._memory.move_to_end(cache_key)
+                        return value
+                    del self._memory[cache_key]
+                
+                # Check if the entry is stored
+                stored = self._entries().get(cache_key)
             
-            # Load metadata
-            with open(meta_path, 'r') as f:
-                metadata = json.load(f)
+            if stored is None:
+                return None
             
             # Check if cache is expired
-            created_at = datetime.fromisoformat(metadata['created_at'])
-            ttl = metadata.get('ttl', self.default_ttl)
+            created_at, ttl, _ = stored
+            expires_at = created_at + ttl
             
-            if datetime.now() > created_at + timedelta(seconds=ttl):
+            if time.time() > expires_at:
                 self.delete(key)
                 return None
             
             # Load cached data
-            with open(cache_path, 'rb') as f:
-                return pickle.load(f)
+            try:
+                with open(self._get_cache_path(cache_key), 'rb') as f:
+                    f.seek(ENTRY_HEADER.size)
+                    value = _decode_payload(f.read())
+            except FileNotFoundError:
+                self.delete(key)
+                return None
+            
+            self._remember(cache_key, value, expires_at)
+            return value
                 
         except Exception as e:
             print(f"Error reading from cache: {e}")
@@ -61,26 +217,36 @@ class CacheManager:
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """Set item in cache"""
+        if not self.enabled:
+            return False
+        
         try:
             cache_key = self._get_cache_key(key)
-            cache_path = self._get_cache_path(cache_key)
-            meta_path = self._get_metadata_path(cache_key)
-            
-            # Save data
-            with open(cache_path, 'wb') as f:
-                pickle.dump(value, f)
-            
-            # Save metadata
-            metadata = {
-                'key': key,
-                'cache_key': cache_key,
-                'created_at': datetime.now().isoformat(),
-                'ttl': ttl or self.default_ttl,
-                'size': os.path.getsize(cache_path)
-            }
             
-            with open(meta_path, 'w') as f:
-                json.dump(metadata, f)
+            # Create the shard directory, and the cache directory with it, once
+            shard = cache_key[:2]
+            if shard not in self._shards:
+                os.makedirs(self._get_shard_dir(cache_key), exist_ok=True)
+                self._shards.add(shard)
+            
+            # Save the header and data together
+            created_at = time.time()
+            ttl = ttl or self.default_ttl
+            data = _encode_payload(value)
+            
+            # Build the index before the file exists, so the first scan doesn't
+            # record the new entry as well and push it onto the heap twice
+            with self._lock:
+                self._entries()
+            
+            with open(self._get_cache_path(cache_key), 'wb') as f:
+                f.write(ENTRY_HEADER.pack(ENTRY_MAGIC, created_at, ttl))
+                f.write(data)
+            
+            with self._lock:
+                self._entries()[cache_key] = (created_at, ttl, len(data))
+                heapq.heappush(self._eviction_heap, (created_at, cache_key))
+            self._remember(cache_key, value, created_at + ttl)
             
             # Clean up old cache if needed
             self._cleanup_old_cache()
@@ -91,31 +257,47 @@ class CacheManager:
             print(f"Error writing to cache: {e}")
             return False
     
+    def _remember(self, cache_key: str, value: Any, expires_at: float):
+        """Keep an entry in memory, evicting the least recently used past the limit"""
+        with self._lock:
+            self._memory[cache_key] = (expires_at, value)
+            self._memory.move_to_end(cache_key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+    
     def delete(self, key: str) -> bool:
         """Delete item from cache"""
+        return self._delete_files(self._get_cache_key(key))
+    
+    def _delete_files(self, cache_key: str) -> bool:
+        """Delete the files of a cache entry by its hashed key"""
+        with self._lock:
+            self._memory.pop(cache_key, None)
+            if self._index is not None:
+                self._index.pop(cache_key, None)
+        
         try:
-            cache_key = self._get_cache_key(key)
-            cache_path = self._get_cache_path(cache_key)
-            meta_path = self._get_metadata_path(cache_key)
-            
-            if os.path.exists(cache_path):
-                os.remove(cache_path)
-            
-            if os.path.exists(meta_path):
-                os.remove(meta_path)
-            
+            os.remove(self._get_cache_path(cache_key))
             return True
             
+        except FileNotFoundError:
+            return True
         except Exception as e:
             print(f"Error deleting from cache: {e}")
             return False
     
     def clear(self) -> bool:
         """Clear all cache"""
+        with self._lock:
+            self._memory.clear()
+            self._index = {}
+            self._eviction_heap = []
+        
         try:
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.cache') or filename.endswith('.meta'):
-                    os.remove(os.path.join(self.cache_dir, filename))
+            for directory, _, filenames in os.walk(self.cache_dir):
+                for filename in filenames:
+                    if filename.endswith(('.bin',) + LEGACY_SUFFIXES):
+                        os.remove(os.path.join(directory, filename))
             return True
             
         except Exception as e:
@@ -125,65 +307,75 @@ class CacheManager:
     def _cleanup_old_cache(self):
         """Clean up old cache items"""
         try:
-            # Get all cache files
-            cache_files = []
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.meta'):
-                    meta_path = os.path.join(self.cache_dir, filename)
-                    with open(meta_path, 'r') as f:
-                        metadata = json.load(f)
-                    cache_files.append((meta_path, metadata))
-            
-            # Sort by creation time
-            cache_files.sort(key=lambda x: x[1]['created_at'])
-            
-            # Remove oldest files if exceeding max cache size
-            while len(cache_files) > self.max_cache_size:
-                meta_path, metadata = cache_files.pop(0)
-                self.delete(metadata['key'])
+            with self._lock:
+                entries = self._entries()
+                
+                # Remove oldest entries if exceeding max cache size
+                oldest = []
+                while len(entries) - len(oldest) > self.max_cache_size and self._eviction_heap:
+                    created_at, cache_key = heapq.heappop(self._eviction_heap)
+                    stored = entries.get(cache_key)
+                    if stored is not None and stored[0] == created_at:
+                        oldest.append(cache_key)
+                
+                # Drop stale items once they outnumber live ones
+                if len(self._eviction_heap) > 2 * len(entries):
+                    self._rebuild_eviction_heap()
+            
+            for cache_key in oldest:
+                self._delete_files(cache_key)
                 
         except Exception as e:
             print(f"Error cleaning up cache: {e}")
     
+    def cleanup_expired(self):
+        """Delete expired cache items"""
+        try:
+            now = time.time()
+            with self._lock:
+                expired = [
+                    cache_key for cache_key, (created_at, ttl, _) in self._entries().items()
+                    if now > created_at + ttl
+                ]
+            
+            for cache_key in expired:
+                self._delete_files(cache_key)
+                
+        except Exception as e:
+            print(f"Error cleaning expired cache: {e}")
+    
     def get_stats(self) -> Dict:
         """Get cache statistics"""
         try:
-            stats = {
-                'total_items': 0,
-                'total_size': 0,
-                'expired_items': 0,
+            now = time.time()
+            with self._lock:
+                entries = list(self._entries().values())
+            
+            return {
+                'total_items': len(entries),
+                'total_size': sum(size for _, _, size in entries),
+                'expired_items': sum(1 for created_at, ttl, _ in entries if now > created_at + ttl),
                 'cache_dir': self.cache_dir
             }
             
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.meta'):
-                    meta_path = os.path.join(self.cache_dir, filename)
-                    with open(meta_path, 'r') as f:
-                        metadata = json.load(f)
-                    
-                    stats['total_items'] += 1
-                    stats['total_size'] += metadata.get('size', 0)
-                    
-                    # Check if expired
-                    created_at = datetime.fromisoformat(metadata['created_at'])
-                    ttl = metadata.get('ttl', self.default_ttl)
-                    
-                    if datetime.now() > created_at + timedelta(seconds=ttl):
-                        stats['expired_items'] += 1
-            
-            return stats
-            
         except Exception as e:
             print(f"Error getting cache stats: {e}")
             return {'error': str(e)}
 
-# Global cache instance
+# Global cache instance; creating it has no side effects
 cache = CacheManager()
 
+def configure_cache(enabled: bool):
+    """Turn the global cache on or off, e.g. from the CACHE_ENABLED setting"""
+    cache.enabled = enabled
+
 def cached_transcription(video_url: str, max_duration: int = 30):
     """Cache decorator for transcription results"""
     def decorator(func):
         def wrapper(*args, **kwargs):
+            if not cache.enabled:
+                return func(*args, **kwargs)
+            
             # Create cache key
             cache_key = f"transcript_{video_url}_{max_duration}"
             
@@ -202,11 +394,14 @@ def cached_transcription(video_url: str, max_duration: int = 30):
 
 def cached_notes(transcript_hash: str, options: Dict):
     """Cache decorator for notes generation"""
+    # The key depends only on the decorator arguments, so build it once
+    options_str = json.dumps(options, sort_keys=True, separators=(',', ':'))
+    cache_key = f"notes_{transcript_hash}_{_digest(options_str)}"
+    
     def decorator(func):
         def wrapper(*args, **kwargs):
-            # Create cache key
-            options_str = json.dumps(sorted(options.items()))
-            cache_key = f"notes_{transcript_hash}_{hashlib.md5(options_str.encode()).hexdigest()}"
+            if not cache.enabled:
+                return func(*args, **kwargs)
             
             # Try to get from cache
             cached_result = cache.get(cache_key)
@@ -225,6 +420,9 @@ def cached_embeddings(text_hash: str):
     """Cache decorator for embeddings"""
     def decorator(func):
         def wrapper(*args, **kwargs):
+            if not cache.enabled:
+                return func(*args, **kwargs)
+            
             # Create cache key
             cache_key = f"embeddings_{text_hash}"
             
@@ -241,65 +439,113 @@ def cached_embeddings(text_hash: str):
         return wrapper
     return decorator
 
+def cached_llm(ttl: int = 24*60*60):
+    """Cache decorator for async LLM calls on an object with `model` and `cache` attributes
+    
+    The key is a SHA-256 of the model, the method and its arguments. Caching is
+    skipped when the object's cache is None or disabled, and failed calls are
+    never cached.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            store = getattr(self, 'cache', None)
+            if store is None or not store.enabled:
+                return await func(self, *args, **kwargs)
+            
+            # Create cache key, leaving out callbacks such as stream handlers
+            key_kwargs = {name: value for name, value in kwargs.items() if not callable(value)}
+            request = json.dumps([self.model, func.__name__, args, key_kwargs], sort_keys=True, default=str)
+            cache_key = f"llm_{hashlib.sha256(request.encode()).hexdigest()}"
+            
+            # Try to get from cache, keeping disk I/O off the event loop
+            cached_result = await asyncio.to_thread(store.get, cache_key)
+            if cached_result is not None:
+                return cached_result
+            
+            # Execute function and cache result
+            result = await func(self, *args, **kwargs)
+            await asyncio.to_thread(store.set, cache_key, result, ttl)
+            
+            return result
+        return wrapper
+    return decorator
+
 def get_text_hash(text: str) -> str:
     """Get hash of text for caching"""
-    return hashlib.md5(text.encode()).hexdigest()
+    return _digest(text)
 
 def cleanup_expired_cache():
     """Clean up expired cache items"""
-    try:
-        for filename in os.listdir(cache.cache_dir):
-            if filename.endswith('.meta'):
-                meta_path = os.path.join(cache.cache_dir, filename)
-                with open(meta_path, 'r') as f:
-                    metadata = json.load(f)
-                
-                # Check if expired
-                created_at = datetime.fromisoformat(metadata['created_at'])
-                ttl = metadata.get('ttl', cache.default_ttl)
-                
-                if datetime.now() > created_at + timedelta(seconds=ttl):
-                    cache.delete(metadata['key'])
-                    
-    except Exception as e:
-        print(f"Error cleaning expired cache: {e}")
+    cache.cleanup_expired()
 
 # Performance monitoring
+class RunningStats:
+    """Count, mean, spread and range of a series, updated in O(1) per value (Welford)"""
+    
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+    
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    def add(self, value: float):
+        """Add a value to the series"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+    
+    @property
+    def std(self) -> float:
+        """Population standard deviation"""
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
 class PerformanceMonitor:
-    """Monitor performance metrics"""
+    """Monitor performance metrics
+    
+    Each operation keeps running statistics rather than every recorded time,
+    so memory stays constant however long the process runs.
+    """
     
     def __init__(self):
         self.metrics = {
-            'transcription_times': [],
-            'notes_generation_times': [],
-            'embedding_times': [],
-            'qa_response_times': []
+            'transcription_times': RunningStats(),
+            'notes_generation_times': RunningStats(),
+            'embedding_times': RunningStats(),
+            'qa_response_times': RunningStats()
         }
     
     def record_time(self, operation: str, duration: float):
         """Record operation time"""
         if operation in self.metrics:
-            self.metrics[operation].append(duration)
+            self.metrics[operation].add(duration)
     
     def get_avg_time(self, operation: str) -> float:
         """Get average time for operation"""
-        times = self.metrics.get(operation, [])
-        return sum(times) / len(times) if times else 0.0
+        times = self.metrics.get(operation)
+        return times.mean if times else 0.0
     
     def get_stats(self) -> Dict:
         """Get performance statistics"""
         stats = {}
         for operation, times in self.metrics.items():
-            if times:
+            if times.count:
                 stats[operation] = {
-                    'avg': sum(times) / len(times),
-                    'min': min(times),
-                    'max': max(times),
-                    'count': len(times)
+                    'avg': times.mean,
+                    'min': times.min,
+                    'max': times.max,
+                    'std': times.std,
+                    'count': times.count
                 }
             else:
                 stats[operation] = {
-                    'avg': 0, 'min': 0, 'max': 0, 'count': 0
+                    'avg': 0, 'min': 0, 'max': 0, 'std': 0, 'count': 0
                 }
         return stats
 
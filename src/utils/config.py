@@ -1,30 +1,53 @@
+import hashlib
 import os
-from typing import Dict, Optional
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
 import streamlit as st
 from dotenv import load_dotenv
+from utils.cache import configure_cache
 
 def load_config() -> Dict:
     """Load configuration from environment variables and session state"""
     
+    config = {
+        **_load_env_config(),
+        'groq_api_key': get_api_key('GROQ_API_KEY', 'groq_api_key')
+    }
+    
+    # Apply the cache setting before any cached work runs
+    configure_cache(config['cache_enabled'])
+    
+    # Initialize session state defaults
+    initialize_session_state(config)
+    
+    return config
+
+@lru_cache(maxsize=1)
+def _load_env_config() -> Mapping:
+    """Parse environment-derived settings once per process"""
+    
     # Load environment variables
     load_dotenv()
     
-    config = {
-        'groq_api_key': get_api_key('GROQ_API_KEY', 'groq_api_key'),
+    return MappingProxyType({
         'max_video_duration': int(os.getenv('MAX_VIDEO_DURATION', '30')),
         'chunk_size': int(os.getenv('CHUNK_SIZE', '1000')),
         'max_sources': int(os.getenv('MAX_SOURCES', '3')),
+        'search_ef': int(os.getenv('SEARCH_EF', '64')),
         'embedding_model': os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2'),
         'chat_model': os.getenv('CHAT_MODEL', 'llama-3.3-70b-versatile'),
         'data_directory': os.getenv('DATA_DIRECTORY', './data'),
         'cache_enabled': os.getenv('CACHE_ENABLED', 'true').lower() == 'true',
         'debug_mode': os.getenv('DEBUG_MODE', 'false').lower() == 'true'
-    }
-    
-    # Initialize session state defaults
-    initialize_session_state(config)
+    })
+
+def get_search_ef() -> int:
+    """Get the HNSW query-time ef that new vector collections are created with"""
     
-    return config
+    return _load_env_config()['search_ef']
 
 def get_api_key(env_var: str, session_key: str) -> Optional[str]:
     """Get API key from environment or session state"""
@@ -40,13 +63,15 @@ def get_api_key(env_var: str, session_key: str) -> Optional[str]:
 def initialize_session_state(config: Dict):
     """Initialize session state with default values"""
     
+    limits = get_processing_limits()
+    
     defaults = {
-        'processed_videos': [],
+        'processed_videos': deque(maxlen=limits['max_processed_videos']),
         'current_video': None,
         'current_transcript': None,
         'current_notes': None,
         'vector_store': None,
-        'qa_history': [],
+        'qa_history': deque(maxlen=limits['max_qa_history']),
         'processing_status': None,
         'max_duration': config['max_video_duration'],
         'chunk_size': config['chunk_size'],
@@ -61,26 +86,43 @@ def initialize_session_state(config: Dict):
         if key not in st.session_state:
             st.session_state[key] = value
 
-def get_supported_platforms() -> Dict[str, str]:
+@lru_cache(maxsize=1)
+def get_supported_platforms() -> Mapping[str, str]:
     """Get supported video platforms"""
     
-    return {
+    return MappingProxyType({
         'YouTube': 'youtube.com, youtu.be',
         'Vimeo': 'vimeo.com',
         'Dailymotion': 'dailymotion.com',
         'Twitch': 'twitch.tv'
-    }
+    })
 
-def get_processing_limits() -> Dict[str, int]:
+@lru_cache(maxsize=1)
+def get_processing_limits() -> Mapping[str, int]:
     """Get processing limits"""
     
-    return {
+    return MappingProxyType({
         'max_video_duration': 60,  # minutes
         'max_file_size': 500,      # MB
         'max_transcript_length': 100000,  # characters
         'max_notes_sections': 50,
-        'max_qa_history': 20
-    }
+        'max_qa_history': 20,
+        'max_processed_videos': 50
+    })
+
+def format_timestamp(timestamp: Optional[float], default: str = 'Recently') -> str:
+    """Format a stored epoch timestamp for display"""
+    
+    if timestamp is None:
+        return default
+    
+    return datetime.fromtimestamp(timestamp).isoformat(sep=' ', timespec='seconds')
+
+def widget_key(prefix: str, *parts) -> str:
+    """Build a widget key from content so it stays stable across reruns and restarts"""
+    
+    digest = hashlib.blake2b("\x1f".join(map(str, parts)).encode(), digest_size=8).hexdigest()
+    return f"{prefix}_{digest}"
 
 def validate_configuration() -> Dict[str, bool]:
     """Validate current configuration"""
@@ -107,28 +149,30 @@ def create_data_directories():
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
 
-def get_app_info() -> Dict:
+@lru_cache(maxsize=1)
+def get_app_info() -> Mapping:
     """Get application information"""
     
-    return {
+    return MappingProxyType({
         'name': 'Video Content Analyzer',
         'version': '1.0.0',
         'description': 'Transform video content into searchable, structured knowledge',
         'author': 'Assistant',
-        'supported_formats': ['YouTube', 'Vimeo', 'Dailymotion', 'Twitch'],
-        'features': [
+        'supported_formats': ('YouTube', 'Vimeo', 'Dailymotion', 'Twitch'),
+        'features': (
             'Video transcription',
             'Structured note generation',
             'RAG-powered Q&A',
             'Multiple export formats',
             'Real-time processing'
-        ]
-    }
+        )
+    })
 
-def get_default_prompts() -> Dict[str, str]:
+@lru_cache(maxsize=1)
+def get_default_prompts() -> Mapping[str, str]:
     """Get default prompts for various operations"""
     
-    return {
+    return MappingProxyType({
         'notes_generation': """
         You are an expert content analyzer and note-taker. Your task is to transform a video transcript into well-structured, comprehensive notes. Follow these guidelines:
 
@@ -173,12 +217,26 @@ def get_default_prompts() -> Dict[str, str]:
         Based on the question, answer, and context, suggest 3 relevant follow-up questions
         that would help the user explore the topic further.
         """
-    }
+    })
 
-def get_error_messages() -> Dict[str, str]:
+@lru_cache(maxsize=1)
+def get_default_suggested_questions() -> Tuple[str, ...]:
+    """Get generic suggested questions that apply to any video"""
+    
+    return (
+        "What are the main topics discussed?",
+        "Can you summarize the key points?",
+        "What are the most important takeaways?",
+        "Are there any specific examples mentioned?",
+        "What conclusions were drawn?",
+        "What questions are answered in this video?"
+    )
+
+@lru_cache(maxsize=1)
+def get_error_messages() -> Mapping[str, str]:
     """Get standard error messages"""
     
-    return {
+    return MappingProxyType({
         'invalid_url': 'Please enter a valid video URL from a supported platform.',
         'missing_api_key': 'Please configure your Groq API key in the sidebar settings.',
         'transcription_failed': 'Video transcription failed. Please try again.',
@@ -194,12 +252,13 @@ def get_error_messages() -> Dict[str, str]:
         'permission_denied': 'Permission denied. Please check your Groq API key permissions.',
         'rate_limit_exceeded': 'Rate limit exceeded. Please wait and try again.',
         'service_unavailable': 'Service temporarily unavailable. Please try again later.'
-    }
+    })
 
-def get_success_messages() -> Dict[str, str]:
+@lru_cache(maxsize=1)
+def get_success_messages() -> Mapping[str, str]:
     """Get standard success messages"""
     
-    return {
+    return MappingProxyType({
         'video_processed': 'Video processed successfully!',
         'notes_generated': 'Notes generated successfully!',
         'qa_ready': 'Q&A system is ready!',
@@ -208,12 +267,13 @@ def get_success_messages() -> Dict[str, str]:
         'settings_saved': 'Settings saved successfully!',
         'cache_cleared': 'Cache cleared successfully!',
         'data_cleared': 'All data cleared successfully!'
-    }
+    })
 
-def get_ui_text() -> Dict[str, str]:
+@lru_cache(maxsize=1)
+def get_ui_text() -> Mapping[str, str]:
     """Get UI text and labels"""
     
-    return {
+    return MappingProxyType({
         'app_title': '🎥 Video Content Analyzer',
         'upload_title': '📤 Upload Video',
         'notes_title': '📄 Video Notes',
@@ -230,4 +290,4 @@ def get_ui_text() -> Dict[str, str]:
         'video_info': '📹 Video Info',
         'sources': '📚 Sources',
         'follow_up': '💡 Follow-up Questions'
-    }
\ No newline at end of file
+    })
\ No newline at end of file
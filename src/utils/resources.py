@@ -0,0 +1,34 @@
+import streamlit as st
+from services.video_processor import VideoProcessor
+from services.transcription_service import TranscriptionService
+from services.notes_generator import NotesGenerator
+from services.rag_system import RAGSystem
+from utils.cache import cache
+from utils.config import get_search_ef
+
+# Service singletons shared across Streamlit reruns and sessions
+
+@st.cache_resource(show_spinner=False)
+def get_video_processor() -> VideoProcessor:
+    """Get the shared video processor"""
+    return VideoProcessor(cache=cache)
+
+@st.cache_resource(show_spinner=False)
+def get_transcription_service() -> TranscriptionService:
+    """Get the shared transcription service"""
+    return TranscriptionService()
+
+@st.cache_resource(show_spinner=False)
+def get_notes_generator(api_key: str) -> NotesGenerator:
+    """Get the notes generator for an API key"""
+    # Share the RAG system's embedding model for the semantic response cache
+    return NotesGenerator(
+        api_key=api_key,
+        embedding_model=get_rag_system(api_key).embedding_model,
+        cache=cache
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_rag_system(api_key: str) -> RAGSystem:
+    """Get the RAG system for an API key"""
+    return RAGSystem(api_key=api_key, search_ef=get_search_ef())
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from utils.cache import CacheManager, cached_llm
+
+
+def stored_files(cache_dir):
+    return sorted(
+        filename for _, _, filenames in os.walk(cache_dir) for filename in filenames if filename.endswith('.bin')
+    )
+
+
+def test_first_set_indexes_the_entry_once(tmp_path):
+    cache = CacheManager(str(tmp_path / "cache"))
+
+    assert cache.set("key", "value")
+
+    assert len(cache._eviction_heap) == 1
+    assert cache.get_stats()['total_items'] == 1
+
+
+def test_oldest_entries_are_evicted_past_the_limit(tmp_path):
+    cache = CacheManager(str(tmp_path / "cache"))
+
+    for key in ("first", "second", "third"):
+        cache.set(key, key)
+        time.sleep(0.001)
+
+    cache.max_cache_size = 2
+    cache.set("fourth", "fourth")
+
+    assert len(stored_files(cache.cache_dir)) == 2
+    assert cache.get_stats()['total_items'] == 2
+
+    # A fresh manager sees only what is on disk
+    reopened = CacheManager(cache.cache_dir)
+    assert reopened.get("first") is None
+    assert reopened.get("second") is None
+    assert reopened.get("third") == "third"
+    assert reopened.get("fourth") == "fourth"
+
+
+def test_entries_round_trip_through_disk(tmp_path):
+    cache = CacheManager(str(tmp_path / "cache"))
+    value = {'sections': [{'title': "Intro", 'content': "x" * 2000}]}
+
+    cache.set("notes", value)
+
+    assert CacheManager(cache.cache_dir).get("notes") == value
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = CacheManager(str(tmp_path / "cache"))
+    cache.set("key", "value", ttl=1)
+    cache._memory.clear()
+
+    created_at, ttl, size = cache._index[cache._get_cache_key("key")]
+    cache._index[cache._get_cache_key("key")] = (created_at - 2, ttl, size)
+
+    assert cache.get("key") is None
+    assert stored_files(cache.cache_dir) == []
+
+
+class FakeLLM:
+    """Object shaped like the services cached_llm decorates"""
+
+    def __init__(self, cache, model="model-a"):
+        self.cache = cache
+        self.model = model
+        self.calls = 0
+        self.fail = False
+
+    @cached_llm(ttl=60)
+    async def complete(self, prompt, on_delta=None):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("service unavailable")
+        return {'reply': prompt.upper()}
+
+
+@pytest.fixture
+def llm(tmp_path):
+    return FakeLLM(CacheManager(str(tmp_path / "cache")))
+
+
+def test_cached_llm_reuses_replies_for_the_same_request(llm):
+    assert asyncio.run(llm.complete("hi")) == {'reply': "HI"}
+    assert asyncio.run(llm.complete("hi", on_delta=print)) == {'reply': "HI"}
+    assert llm.calls == 1
+
+    asyncio.run(llm.complete("bye"))
+    assert llm.calls == 2
+
+
+def test_cached_llm_keys_on_the_model(llm):
+    asyncio.run(llm.complete("hi"))
+    other = FakeLLM(llm.cache, model="model-b")
+
+    asyncio.run(other.complete("hi"))
+
+    assert other.calls == 1
+
+
+def test_cached_llm_never_caches_failures(llm):
+    llm.fail = True
+    with pytest.raises(RuntimeError):
+        asyncio.run(llm.complete("hi"))
+
+    llm.fail = False
+    assert asyncio.run(llm.complete("hi")) == {'reply': "HI"}
+    assert llm.calls == 2
+
+
+def test_cached_llm_bypasses_a_disabled_cache(llm):
+    llm.cache.enabled = False
+
+    asyncio.run(llm.complete("hi"))
+    asyncio.run(llm.complete("hi"))
+
+    assert llm.calls == 2
+
+
+def test_cached_llm_runs_without_a_cache(llm):
+    llm.cache = None
+
+    asyncio.run(llm.complete("hi"))
+    asyncio.run(llm.complete("hi"))
+
+    assert llm.calls == 2
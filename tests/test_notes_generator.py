@@ -0,0 +1,138 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from services.notes_generator import NotesGenerator, SectionStreamParser
+from utils.cache import CacheManager
+
+NOTES_JSON = '{"sections": [{"title": "Intro", "timestamp": "00:00", "content": "Welcome"}], "topics": ["Intro"]}'
+
+VIDEO_INFO = {'title': 'Lecture', 'video_id': 'abc', 'platform': 'YouTube'}
+
+
+class FakeCompletions:
+    """Async chat completions that answer from a list of replies, counting calls"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    async def create(self, stream=False, **kwargs):
+        self.calls += 1
+        content = self.replies.pop(0)
+        if stream:
+            return self._stream(content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    async def _stream(self, content):
+        for i in range(0, len(content), 5):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + 5]))])
+
+
+class FakeEmbeddingModel:
+    def encode(self, texts, **kwargs):
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+def with_fake_client(generator):
+    generator.completions = FakeCompletions([])
+    generator.client = SimpleNamespace(chat=SimpleNamespace(completions=generator.completions))
+    return generator
+
+
+@pytest.fixture
+def generator():
+    return with_fake_client(NotesGenerator(api_key="test", embedding_model=FakeEmbeddingModel()))
+
+
+@pytest.fixture
+def cached_generator(tmp_path):
+    # Exact-match cache only
+    return with_fake_client(NotesGenerator(api_key="test", cache=CacheManager(str(tmp_path / "cache"))))
+
+
+def test_unparseable_notes_are_not_cached(generator):
+    generator.completions.replies = ["Here are your notes: an intro.", NOTES_JSON]
+
+    notes = generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {})
+    assert notes['sections'][0]['title'] == "Generated Notes"
+
+    # The degraded notes were not cached, so the next run asks again
+    notes = generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {})
+    assert notes['sections'][0]['title'] == "Intro"
+    assert generator.completions.calls == 2
+
+
+def test_parsed_notes_are_reused_for_the_same_video(generator):
+    generator.completions.replies = [NOTES_JSON]
+
+    first = generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {})
+    second = generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {})
+
+    assert first['sections'] == second['sections']
+    assert generator.completions.calls == 1
+
+
+def test_exact_match_cache_skips_unparseable_replies(cached_generator):
+    cached_generator.completions.replies = ["Here are your notes: an intro.", NOTES_JSON]
+
+    notes = cached_generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {})
+    assert notes['sections'][0]['title'] == "Generated Notes"
+
+    notes = cached_generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {})
+    assert notes['sections'][0]['title'] == "Intro"
+    assert cached_generator.completions.calls == 2
+
+
+def test_exact_match_cache_returns_independent_copies(cached_generator):
+    cached_generator.completions.replies = [NOTES_JSON]
+
+    first = cached_generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {})
+    first['sections'][0]['title'] = "Edited"
+    second = cached_generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {})
+
+    assert second['sections'][0]['title'] == "Intro"
+    assert cached_generator.completions.calls == 1
+
+
+STREAMED_NOTES = (
+    '```json\n{"main_theme": "Training", "sections": [\n'
+    '  {"title": "Braces", "content": "Use {curly} and \\"quoted\\" text"},\n'
+    '  {"title": "Nested", "content": "x", "examples": [{"name": "e"}]}\n'
+    '], "topics": [{"not": "a section"}]}\n```'
+)
+
+
+def feed_all(parser, deltas):
+    return [section for delta in deltas for section in parser.feed(delta)]
+
+
+@pytest.mark.parametrize("step", [1, 3, len(STREAMED_NOTES)])
+def test_section_stream_parser_emits_each_completed_section(step):
+    parser = SectionStreamParser()
+
+    sections = feed_all(parser, [STREAMED_NOTES[i:i + step] for i in range(0, len(STREAMED_NOTES), step)])
+
+    assert [section['title'] for section in sections] == ["Braces", "Nested"]
+    assert sections[0]['content'] == 'Use {curly} and "quoted" text'
+    assert sections[1]['examples'] == [{"name": "e"}]
+    assert parser.text == STREAMED_NOTES
+
+
+def test_section_stream_parser_emits_sections_as_soon_as_they_close():
+    parser = SectionStreamParser()
+    first_end = STREAMED_NOTES.index('},') + 1
+
+    assert feed_all(parser, [STREAMED_NOTES[:first_end - 1]]) == []
+    assert [section['title'] for section in parser.feed(STREAMED_NOTES[first_end - 1:first_end])] == ["Braces"]
+
+
+def test_streamed_sections_reach_on_section_once(generator):
+    generator.completions.replies = [STREAMED_NOTES]
+    delivered = []
+
+    notes = generator.generate_notes({'full_text': 'Welcome to the lecture'}, VIDEO_INFO, {}, on_section=delivered.append)
+
+    assert [section['title'] for section in delivered] == ["Braces", "Nested"]
+    assert notes['sections'] == delivered
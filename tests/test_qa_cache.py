@@ -0,0 +1,75 @@
+import numpy as np
+
+from services import qa_cache
+from services.qa_cache import QACache
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_lookup_returns_the_most_similar_result_above_the_threshold():
+    cache = QACache(threshold=0.9)
+    cache.add(unit(1, 0, 0), {'answer': "x"})
+    cache.add(unit(0, 1, 0), {'answer': "y"})
+
+    assert cache.lookup(unit(0.1, 1, 0)) == {'answer': "y"}
+    assert cache.lookup(unit(1, 1, 0)) is None
+
+
+def test_lookup_ignores_embedding_scale():
+    cache = QACache(threshold=0.99)
+    cache.add([3.0, 4.0], {'answer': "x"})
+
+    assert cache.lookup([0.6, 0.8]) == {'answer': "x"}
+
+
+def test_empty_cache_misses():
+    assert QACache().lookup(unit(1, 0)) is None
+
+
+def test_oldest_entries_are_dropped_past_max_entries():
+    cache = QACache(threshold=0.99, max_entries=2)
+    for i, vector in enumerate([unit(1, 0, 0), unit(0, 1, 0), unit(0, 0, 1)]):
+        cache.add(vector, {'answer': i})
+
+    assert len(cache) == 2
+    assert cache.lookup(unit(1, 0, 0)) is None
+    assert cache.lookup(unit(0, 0, 1)) == {'answer': 2}
+
+
+def test_buffer_grows_past_one_block():
+    cache = QACache(threshold=0.99, max_entries=1000)
+    count = qa_cache._GROWTH_ROWS + 5
+    vectors = np.eye(count, dtype=np.float32)
+    for i in range(count):
+        cache.add(vectors[i], {'answer': i})
+
+    assert len(cache) == count
+    assert cache.lookup(vectors[0]) == {'answer': 0}
+    assert cache.lookup(vectors[-1]) == {'answer': count - 1}
+
+
+def test_expired_entries_are_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(qa_cache.time, 'time', lambda: now[0])
+    cache = QACache(threshold=0.99, ttl=60)
+    cache.add(unit(1, 0), {'answer': "old"})
+    now[0] += 30
+    cache.add(unit(0, 1), {'answer': "new"})
+
+    now[0] += 45
+    assert cache.lookup(unit(1, 0)) is None
+    assert cache.lookup(unit(0, 1)) == {'answer': "new"}
+    assert len(cache) == 1
+
+
+def test_clear_removes_everything():
+    cache = QACache()
+    cache.add(unit(1, 0), {'answer': "x"})
+
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.lookup(unit(1, 0)) is None
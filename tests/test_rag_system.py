@@ -0,0 +1,164 @@
+from types import SimpleNamespace
+
+import chromadb
+from chromadb.api.client import SharedSystemClient
+import numpy as np
+import pytest
+
+from services import rag_system
+from services.rag_system import FollowUpSplitter, RAGSystem
+
+
+class FakeEmbeddingModel:
+    """Deterministic stand-in for the sentence-transformers model"""
+
+    def encode(self, texts, **kwargs):
+        vectors = np.array([[len(text), text.count(' ') + 1, 1.0] for text in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class FakeCompletions:
+    """Chat completions that fail, or reply with fixed text"""
+
+    def __init__(self, reply=None):
+        self.reply = reply
+
+    def create(self, stream=False, **kwargs):
+        if self.reply is None:
+            raise RuntimeError("service unavailable")
+        if stream:
+            return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.reply))])])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))])
+
+
+def use_chat_reply(rag, reply):
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(reply)))
+
+
+@pytest.fixture
+def make_rag(tmp_path, monkeypatch):
+    # The vector store lives under ./data/embeddings
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(rag_system._embedding_models, rag_system.EMBEDDING_MODEL_NAME, FakeEmbeddingModel())
+    yield lambda **kwargs: RAGSystem(api_key="test", **kwargs)
+    # Chroma shares clients by path, and every test uses the same relative one
+    SharedSystemClient.clear_system_cache()
+
+
+@pytest.fixture
+def rag(make_rag):
+    return make_rag()
+
+
+@pytest.fixture
+def vector_store(rag):
+    transcript = {
+        'segments': [
+            {'text': 'Gradient descent updates the weights', 'start': '00:00'},
+            {'text': 'The learning rate controls the step size', 'start': '00:10'},
+            {'text': 'Overfitting shows up on the validation set', 'start': '00:20'},
+        ]
+    }
+    return rag.setup_vector_store(transcript, {}, chunk_size=40)
+
+
+def stored_ef_search(collection_name):
+    # Read through a fresh client so the value comes from the store, not a cached model
+    collection = chromadb.PersistentClient(path="./data/embeddings").get_collection(collection_name)
+    return collection.configuration['hnsw']['ef_search']
+
+
+def test_collection_is_created_with_configured_search_ef(make_rag):
+    rag = make_rag(search_ef=128)
+
+    vector_store = rag.setup_vector_store({'segments': [{'text': 'Backpropagation', 'start': '00:00'}]}, {})
+
+    assert stored_ef_search(vector_store['collection_name']) == 128
+
+
+def test_queries_leave_collection_configuration_alone(rag, vector_store):
+    collection_name = vector_store['collection_name']
+    assert stored_ef_search(collection_name) == rag_system.DEFAULT_SEARCH_EF
+
+    chunks = rag._retrieve_relevant_chunks("What does the learning rate do?", 2, vector_store)
+
+    assert chunks
+    assert stored_ef_search(collection_name) == rag_system.DEFAULT_SEARCH_EF
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_failed_generation_is_flagged(rag, vector_store, stream):
+    use_chat_reply(rag, None)
+
+    result = rag.answer_question("What does the learning rate do?", vector_store, {}, stream=stream)
+    if stream:
+        *deltas, result = list(result)
+        assert "".join(deltas) == rag_system.ANSWER_ERROR_MESSAGE
+
+    assert result['error'] is True
+    assert result['answer'] == rag_system.ANSWER_ERROR_MESSAGE
+    assert result['sources']
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_successful_generation_is_not_flagged(rag, vector_store, stream):
+    use_chat_reply(rag, "It sets the step size.\n\nFollow-up questions:\n1. What is momentum?")
+
+    result = rag.answer_question("What does the learning rate do?", vector_store, {}, stream=stream)
+    if stream:
+        result = list(result)[-1]
+
+    assert result['error'] is False
+    assert result['answer'] == "It sets the step size."
+    assert result['follow_up_questions'] == ["What is momentum?"]
+
+
+def test_stats_and_clear_act_on_the_given_video(rag, vector_store):
+    other = rag.setup_vector_store({'segments': [{'text': 'A second video about convolutions', 'start': '00:00'}]}, {})
+
+    # The instance last set up `other`, but calls on `vector_store` still see its own video
+    assert rag.get_collection_stats(vector_store)['total_chunks'] == vector_store['total_chunks']
+
+    rag.clear_collection(vector_store)
+
+    assert rag.get_collection_stats(vector_store)['total_chunks'] == 0
+    assert rag.get_collection_stats(other)['total_chunks'] == other['total_chunks']
+
+
+REPLY = (
+    "Follow the gradient downhill.\n"
+    "The learning rate sets the step size.\n\n"
+    "**Follow-up Questions:**\n"
+    "1. What is momentum?\n"
+    "2. Why decay the learning rate?"
+)
+
+
+def split(deltas):
+    splitter = FollowUpSplitter()
+    shown = [splitter.feed(delta) for delta in deltas]
+    shown.append(splitter.finish())
+    return splitter, "".join(shown)
+
+
+@pytest.mark.parametrize("deltas", [[REPLY], list(REPLY), [REPLY[i:i + 7] for i in range(0, len(REPLY), 7)]])
+def test_follow_up_splitter_keeps_follow_ups_out_of_the_answer(deltas):
+    splitter, shown = split(deltas)
+
+    assert splitter.answer == "Follow the gradient downhill.\nThe learning rate sets the step size."
+    assert shown.strip() == splitter.answer
+    assert splitter.follow_up_text == "1. What is momentum?\n2. Why decay the learning rate?"
+
+
+def test_follow_up_splitter_without_heading_shows_everything():
+    splitter, shown = split(list("Follow-up work is needed.\nFollow"))
+
+    assert shown == "Follow-up work is needed.\nFollow"
+    assert splitter.follow_up_text is None
+
+
+def test_follow_up_splitter_accepts_heading_at_the_end_of_the_reply():
+    splitter, shown = split(["The answer.\n", "Follow-up questions"])
+
+    assert shown == "The answer.\n"
+    assert splitter.follow_up_text == ""